@@ -0,0 +1,144 @@
+import os
+import threading
+import time
+from functools import wraps
+from flask import abort, current_app
+from prometheus_client import Counter, Gauge
+
+'''
+Admission control
+    routes that reach the database are admitted through one limiter per
+    route class, `read` for GETs and `write` for everything that changes
+    rows. Each limiter lets at most ADMISSION_<CLASS>_LIMIT requests run
+    at once; the next ADMISSION_<CLASS>_QUEUE requests wait, first come
+    first served, for up to ADMISSION_<CLASS>_WAIT_MS milliseconds. A
+    request that finds the queue full, or is still waiting when its wait
+    runs out, fails at once with 503 Service Unavailable and a
+    Retry-After of ADMISSION_RETRY_AFTER seconds, instead of holding a
+    worker thread until the connection pool or gunicorn times it out.
+
+                LIMIT   QUEUE   WAIT_MS
+        read       10      20       500
+        write       5      10      1000
+
+    the default limits add up to the default connection pool (DB_POOL_SIZE
+    plus DB_MAX_OVERFLOW). A limit of 0 turns the class off. Limits are
+    per worker process, so they only queue requests under a threaded
+    worker class (gunicorn --threads).
+
+    The limiter sits inside requires_auth and cached_get, so requests that
+    are rejected by auth, answered 304 Not Modified or served from the
+    response cache never wait for a slot. Bodies streamed after the view
+    returns are not limited. admission_queue_depth is the number of
+    requests waiting and admission_shed_total counts the requests turned
+    away, by route class and reason (queue_full or timeout).
+'''
+
+QUEUE_DEPTH = Gauge(
+    'admission_queue_depth', 'Requests waiting for an admission slot',
+    ('route_class',), multiprocess_mode='livesum')
+SHED = Counter(
+    'admission_shed', 'Requests rejected with 503 by admission control',
+    ('route_class', 'reason'))
+
+LIMITS = {
+    # route class: (limit, queue, wait in milliseconds)
+    'read': (10, 20, 500),
+    'write': (5, 10, 1000),
+}
+
+
+class Limiter:
+    def __init__(self, name, limit, queue, wait, retry_after=1):
+        self.name = name
+        self.limit = limit
+        self.queue = queue
+        self.wait = wait
+        self.retry_after = retry_after
+        self.active = 0
+        self.waiting = 0
+        self._ready = threading.Condition(threading.Lock())
+        self._depth = QUEUE_DEPTH.labels(name)
+
+    @classmethod
+    def from_env(cls, name):
+        '''
+        the limiter for route class `name`, or None when its limit is 0
+        '''
+        limit, queue, wait = LIMITS[name]
+        prefix = f'ADMISSION_{name.upper()}_'
+        limit = int(os.environ.get(prefix + 'LIMIT', limit))
+        if limit <= 0:
+            return None
+        return cls(name, limit,
+                   int(os.environ.get(prefix + 'QUEUE', queue)),
+                   float(os.environ.get(prefix + 'WAIT_MS', wait)) / 1000,
+                   int(os.environ.get('ADMISSION_RETRY_AFTER', 1)))
+
+    def acquire(self):
+        '''
+        take a slot, waiting for one if need be; False when the request
+        has to be shed
+        '''
+        with self._ready:
+            # a slot freed while others wait is theirs, not a newcomer's
+            if self.active < self.limit and not self.waiting:
+                self.active += 1
+                return True
+            if self.waiting >= self.queue:
+                SHED.labels(self.name, 'queue_full').inc()
+                return False
+
+            self.waiting += 1
+            self._depth.inc()
+            try:
+                deadline = time.monotonic() + self.wait
+                while self.active >= self.limit:
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        SHED.labels(self.name, 'timeout').inc()
+                        return False
+                    self._ready.wait(remaining)
+                self.active += 1
+                return True
+            finally:
+                self.waiting -= 1
+                self._depth.dec()
+
+    def release(self):
+        with self._ready:
+            self.active -= 1
+            self._ready.notify()
+
+    def stats(self):
+        return {'limit': self.limit, 'active': self.active,
+                'waiting': self.waiting, 'queue': self.queue}
+
+
+def init_app(app):
+    app.extensions['admission'] = {
+        name: Limiter.from_env(name) for name in LIMITS}
+
+
+def admit(route_class):
+    '''
+    admit(route_class)
+        runs the route only once the `route_class` limiter of the app
+        admits it, and aborts with 503 when it sheds the request
+    '''
+    def admit_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            limiter = current_app.extensions.get(
+                'admission', {}).get(route_class)
+            if limiter is None:
+                return f(*args, **kwargs)
+            if not limiter.acquire():
+                abort(503, retry_after=limiter.retry_after)
+            try:
+                return f(*args, **kwargs)
+            finally:
+                limiter.release()
+
+        return wrapper
+    return admit_decorator
@@ -1,22 +1,150 @@
+import datetime
 import os
-from flask import Flask, request, jsonify, abort
-from models import setup_db, Movie, Actor
+from functools import wraps
+from flask import Flask, Response, request, abort
+from werkzeug.exceptions import BadRequest
+from models import setup_db, db, pool_stats, casting, Movie, Actor
 from sqlalchemy import exc
-from flask_migrate import Migrate
-from flask_sqlalchemy import SQLAlchemy
 import json
-from auth import AuthError, requires_auth
+from auth import AuthError, requires_auth, check_permissions
+from cache import cache_stats, cached_get, invalidates
+from admission import admit
+from pagination import page_args, paginate, encode_cursor, ordering
+from search import search
+from stats import load_stats
+from filters import (MOVIE_SORTS, ACTOR_SORTS, sort_keys, movie_filters,
+                     actor_filters, bulk_criteria)
+from streaming import stream_rows, wants_stream
+from serializer import jsonify
+import auth
+import admission
+import metrics
+import queries
+import warmup
+from projection import (MOVIE_FIELDS, ACTOR_FIELDS, MOVIE_INCLUDES,
+                        ACTOR_INCLUDES, FORMAT_FIELDS, parse_fields, shaped,
+                        summary, find)
 from flask_cors import CORS
 import sys
 
+MAX_BATCH_SIZE = int(os.environ.get('MAX_BATCH_SIZE', 1000))
+MAX_BULK_ROWS = int(os.environ.get('MAX_BULK_ROWS', 1000))
+
+
+def batch_items(fields):
+    '''
+    validate a batch create payload up front
+        the body must be a non-empty JSON array of at most MAX_BATCH_SIZE
+        objects that all carry every one of `fields`, each of the type
+        field_value expects; the 400 for an invalid item names its index
+    '''
+    items = request.get_json()
+    if not isinstance(items, list) or len(items) == 0:
+        abort(400)
+    if len(items) > MAX_BATCH_SIZE:
+        abort(413)
+
+    rows = []
+    for index, item in enumerate(items):
+        if not isinstance(item, dict):
+            invalid_item(index)
+        row = {field: field_value(field, item.get(field)) for field in fields}
+        if any(value is None for value in row.values()):
+            invalid_item(index)
+        rows.append(row)
+    return rows
+
+
+def invalid_item(index):
+    error = BadRequest()
+    error.index = index
+    raise error
+
+
+def field_value(field, value):
+    '''
+    the column value of the writable `field` given as `value` in a JSON
+    payload, or None when it is of the wrong type: release_date must be an
+    ISO date string and age a whole number or a string of digits, the
+    others strings
+    '''
+    # bool is an int to isinstance, but never a valid field
+    if isinstance(value, bool):
+        return None
+    if field == 'release_date':
+        try:
+            return datetime.datetime.fromisoformat(value)
+        except (TypeError, ValueError):
+            return None
+    if field == 'age' and isinstance(value, int):
+        value = str(value)
+    if not isinstance(value, str):
+        return None
+    if field == 'age' and not value.isdigit():
+        return None
+    return value
+
+
+def bulk_request(model, fields=()):
+    '''
+    validate a bulk update or delete payload
+        the body must be a JSON object with a `filter` (see
+        filters.bulk_criteria) and, for an update, `changes`: a non-empty
+        object of some of `fields`, each of the type field_value expects
+    '''
+    data = request.get_json()
+    if not isinstance(data, dict):
+        abort(400)
+    criteria = bulk_criteria(model, data.get('filter'))
+    if not fields:
+        return criteria, None
+
+    changes = data.get('changes')
+    if not isinstance(changes, dict) or not changes:
+        abort(400)
+    values = {}
+    for field, value in changes.items():
+        values[field] = field_value(field, value)
+        if field not in fields or values[field] is None:
+            abort(400)
+    return criteria, values
+
+
+def requires_include(includes, permission):
+    '''
+    requires `permission` as well when the request asks for one of
+    `includes` with `?include=`; it goes above cached_get, so a cached
+    response or a 304 cannot skip the check
+    '''
+    def requires_include_decorator(f):
+        @wraps(f)
+        def wrapper(jwt, *args, **kwargs):
+            if parse_fields(includes,
+                            request.args.get('include')) is not None:
+                check_permissions(permission, jwt)
+            return f(jwt, *args, **kwargs)
+
+        return wrapper
+    return requires_include_decorator
+
+
+def included(model):
+    '''
+    for cached_get: [`model`] when the request asks for ?include=, whose
+    rows then show up in the response, and [] otherwise
+    '''
+    return lambda: [model] if 'include' in request.args else []
+
 
 def create_app(test_config=None):
 
     app = Flask(__name__)
     setup_db(app)
     CORS(app)
-    db = SQLAlchemy(app)
-    migrate = Migrate(app, db)
+    queries.init_app(app)
+    metrics.init_app(app)
+    admission.init_app(app)
+    warmup.init_app(app)
 
     @app.after_request
     def after_request(response):
@@ -30,21 +158,41 @@ def create_app(test_config=None):
 
     @app.route('/movies')
     @requires_auth('get:movies')
+    @requires_include(MOVIE_INCLUDES, 'get:actors')
+    @cached_get(Movie, related_for=included(Actor))
+    @admit('read')
     def get_movies(jwt):
-        selection = Movie.query.all()
-        all_movies = [movie.format() for movie in selection]
+        includes = parse_fields(MOVIE_INCLUDES, request.args.get('include'))
+        query, format_row = shaped(
+            Movie, parse_fields(MOVIE_FIELDS, request.args.get('fields')),
+            includes)
+        query = query.filter(*movie_filters(request.args))
+        keys, descending = sort_keys(MOVIE_SORTS, request.args.get('sort'))
+
+        if wants_stream():
+            return stream_rows(query.order_by(*ordering(keys, descending)),
+                               format_row)
+
+        limit, after = page_args()
+        selection, next_cursor = paginate(query, keys, limit, after,
+                                          descending)
+        all_movies = [format_row(row) for row in selection]
         if len(all_movies) == 0:
             abort(404)
         return jsonify({
             'success': True,
             'movies': all_movies,
+            'next': next_cursor,
         }), 200
 
     @app.route('/movies/<int:id>')
     @requires_auth('get:movies')
+    @cached_get(Movie)
+    @admit('read')
     def get_movie_by_id(jwt, id):
         """Get a specific movie route"""
-        movie = Movie.query.get(id)
+        fields = parse_fields(MOVIE_FIELDS, request.args.get('fields'))
+        movie = find(Movie, id, fields)
 
         # return 404 if there is no movie with id
         if movie is None:
@@ -52,11 +200,80 @@ def create_app(test_config=None):
         else:
             return jsonify({
                 'success': True,
-                'movie': movie.format(),
+                'movie': movie,
             }), 200
 
+    @app.route('/movies/<int:id>/actors')
+    @requires_auth('get:actors')
+    @cached_get(Movie, Actor)
+    @admit('read')
+    def get_movie_actors(jwt, id):
+        """Get the actors cast in a movie route"""
+        actors = Actor.query.join(casting).filter(
+            casting.c.movie_id == id).order_by(Actor.id)
+        return jsonify({
+            'success': True,
+            'actors': [summary(actor) for actor in actors],
+        }), 200
+
+    @app.route('/movies/<int:id>/actors', methods=['POST'])
+    @requires_auth('patch:movies')
+    @invalidates(Movie)
+    @admit('write')
+    def post_movie_actor(jwt, id):
+        """Cast an actor in a movie route"""
+        data = request.get_json()
+        actor_id = data.get('actor_id', None)
+
+        # return 400 for a missing or non integer actor id
+        if not isinstance(actor_id, int):
+            abort(400)
+
+        movie = Movie.query.get(id)
+        actor = Actor.query.get(actor_id)
+
+        if movie is None or actor is None:
+            abort(404)
+
+        # return 422 if the actor is already cast in the movie
+        if actor in movie.actors:
+            abort(422)
+
+        try:
+            movie.cast(actor)
+            return jsonify({
+                'success': True,
+                'actors': [summary(member) for member in movie.actors],
+            }), 201
+        except Exception:
+            db.session.rollback()
+            abort(500)
+
+    @app.route('/movies/<int:id>/actors/<int:actor_id>', methods=['DELETE'])
+    @requires_auth('patch:movies')
+    @invalidates(Movie)
+    @admit('write')
+    def delete_movie_actor(jwt, id, actor_id):
+        """Remove an actor from the cast of a movie route"""
+        movie = Movie.query.get(id)
+        actor = Actor.query.get(actor_id)
+
+        if movie is None or actor not in movie.actors:
+            abort(404)
+        try:
+            movie.uncast(actor)
+            return jsonify({
+                'success': True,
+                'actors': [summary(member) for member in movie.actors],
+            })
+        except Exception:
+            db.session.rollback()
+            abort(500)
+
     @app.route('/movies', methods=['POST'])
     @requires_auth('post:movies')
+    @invalidates(Movie)
+    @admit('write')
     def post_movie(jwt):
         """Create a movie route"""
         data = request.get_json()
@@ -78,8 +295,70 @@ def create_app(test_config=None):
         except Exception:
             abort(500)
 
+    @app.route('/movies/batch', methods=['POST'])
+    @requires_auth('post:movies')
+    @invalidates(Movie)
+    @admit('write')
+    def post_movies_batch(jwt):
+        """Create many movies in one transaction route"""
+        rows = batch_items(['title', 'release_date'])
+
+        try:
+            movies = Movie.insert_many(rows)
+            return jsonify({
+                'success': True,
+                'created': len(movies),
+                'movies': movies
+            }), 201
+        except Exception:
+            abort(500)
+
+    @app.route('/movies', methods=['PATCH'])
+    @requires_auth('patch:movies')
+    @invalidates(Movie)
+    @admit('write')
+    def patch_movies(jwt):
+        """Update every movie matching a filter route"""
+        criteria, changes = bulk_request(Movie, ['title', 'release_date'])
+
+        try:
+            updated = Movie.update_where(criteria, changes, MAX_BULK_ROWS)
+        except Exception:
+            abort(500)
+
+        # more than MAX_BULK_ROWS movies matched; none were changed
+        if updated is None:
+            abort(422)
+        return jsonify({
+            'success': True,
+            'updated': updated
+        })
+
+    @app.route('/movies', methods=['DELETE'])
+    @requires_auth('delete:movies')
+    @invalidates(Movie)
+    @admit('write')
+    def delete_movies(jwt):
+        """Delete every movie matching a filter route"""
+        criteria, _ = bulk_request(Movie)
+
+        try:
+            deleted = Movie.delete_where(criteria, MAX_BULK_ROWS)
+        except Exception:
+            abort(500)
+
+        # more than MAX_BULK_ROWS movies matched; none were deleted
+        if deleted is None:
+            abort(422)
+        return jsonify({
+            'success': True,
+            'deleted': deleted
+        })
+
     @app.route('/movies/<int:id>', methods=['PATCH'])
     @requires_auth('patch:movies')
+    @invalidates(Movie)
+    @admit('write')
     def patch_movie(jwt, id):
         """Update a movie route"""
 
@@ -87,73 +366,107 @@ def create_app(test_config=None):
         title = data.get('title', None)
         release_date = data.get('release_date', None)
 
-        movie = Movie.query.get(id)
-
-        if movie is None:
-            abort(404)
-
         if title is None or release_date is None:
             abort(400)
 
-        movie.title = title
-        movie.release_date = release_date
-
+        # one UPDATE ... RETURNING; no row means no such movie
         try:
-            movie.update()
-            return jsonify({
-                'success': True,
-                'movie': movie.format()
-            }), 200
+            movie = Movie.update_row(
+                id, {'title': title, 'release_date': release_date},
+                FORMAT_FIELDS[Movie])
         except Exception:
             abort(500)
 
+        if movie is None:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'movie': movie
+        }), 200
+
     @app.route('/movies/<int:id>', methods=['DELETE'])
     @requires_auth('delete:movies')
+    @invalidates(Movie)
+    @admit('write')
     def delete_movie(jwt, id):
         """Delete a movie route"""
-        movie = Movie.query.get(id)
-
-        if movie is None:
-            abort(404)
         try:
-            movie.delete()
-            return jsonify({
-                'success': True,
-                'message':
-                f'movie id {movie.id}, titled {movie.title} was deleted',
-            })
+            movie = Movie.delete_row(id, ('id', 'title'))
         except Exception:
             db.session.rollback()
             abort(500)
 
+        if movie is None:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'message':
+            f'movie id {movie["id"]}, titled {movie["title"]} was deleted',
+        })
+
     @app.route('/actors')
     @requires_auth('get:actors')
+    @requires_include(ACTOR_INCLUDES, 'get:movies')
+    @cached_get(Actor, related_for=included(Movie))
+    @admit('read')
     def get_actors(jwt):
-        selection = Actor.query.all()
-        all_actors = [actor.format() for actor in selection]
+        includes = parse_fields(ACTOR_INCLUDES, request.args.get('include'))
+        query, format_row = shaped(
+            Actor, parse_fields(ACTOR_FIELDS, request.args.get('fields')),
+            includes)
+        query = query.filter(*actor_filters(request.args))
+        keys, descending = sort_keys(ACTOR_SORTS, request.args.get('sort'))
+
+        if wants_stream():
+            return stream_rows(query.order_by(*ordering(keys, descending)),
+                               format_row)
+
+        limit, after = page_args()
+        selection, next_cursor = paginate(query, keys, limit, after,
+                                          descending)
+        all_actors = [format_row(row) for row in selection]
         if len(all_actors) == 0:
             abort(404)
         return jsonify({
             'success': True,
             'actors': all_actors,
+            'next': next_cursor,
         }), 200
 
     @app.route('/actors/<int:id>')
     @requires_auth('get:actors')
+    @cached_get(Actor)
+    @admit('read')
     def get_actor_by_id(jwt, id):
         """Get all actors route"""
-        actor = Actor.query.get(id)
+        fields = parse_fields(ACTOR_FIELDS, request.args.get('fields'))
+        actor = find(Actor, id, fields)
 
         if actor is None:
             abort(404)
         else:
             return jsonify({
                 'success': True,
-                'actor': actor.format(),
+                'actor': actor,
             }), 200
 
+    @app.route('/actors/<int:id>/movies')
+    @requires_auth('get:movies')
+    @cached_get(Actor, Movie)
+    @admit('read')
+    def get_actor_movies(jwt, id):
+        """Get the movies an actor is cast in route"""
+        movies = Movie.query.join(casting).filter(
+            casting.c.actor_id == id).order_by(Movie.id)
+        return jsonify({
+            'success': True,
+            'movies': [movie.format() for movie in movies],
+        }), 200
+
     @app.route('/actors', methods=['POST'])
     @requires_auth('post:actors')
+    @invalidates(Actor)
+    @admit('write')
     def post_actor(jwt):
         """Get all movies route"""
         data = request.get_json()
@@ -175,8 +488,70 @@ def create_app(test_config=None):
         except Exception:
             abort(500)
 
+    @app.route('/actors/batch', methods=['POST'])
+    @requires_auth('post:actors')
+    @invalidates(Actor)
+    @admit('write')
+    def post_actors_batch(jwt):
+        """Create many actors in one transaction route"""
+        rows = batch_items(['name', 'age', 'gender'])
+
+        try:
+            actors = Actor.insert_many(rows)
+            return jsonify({
+                'success': True,
+                'created': len(actors),
+                'actors': actors
+            }), 201
+        except Exception:
+            abort(500)
+
+    @app.route('/actors', methods=['PATCH'])
+    @requires_auth('patch:actors')
+    @invalidates(Actor)
+    @admit('write')
+    def patch_actors(jwt):
+        """Update every actor matching a filter route"""
+        criteria, changes = bulk_request(Actor, ['name', 'age', 'gender'])
+
+        try:
+            updated = Actor.update_where(criteria, changes, MAX_BULK_ROWS)
+        except Exception:
+            abort(500)
+
+        # more than MAX_BULK_ROWS actors matched; none were changed
+        if updated is None:
+            abort(422)
+        return jsonify({
+            'success': True,
+            'updated': updated
+        })
+
+    @app.route('/actors', methods=['DELETE'])
+    @requires_auth('delete:actors')
+    @invalidates(Actor)
+    @admit('write')
+    def delete_actors(jwt):
+        """Delete every actor matching a filter route"""
+        criteria, _ = bulk_request(Actor)
+
+        try:
+            deleted = Actor.delete_where(criteria, MAX_BULK_ROWS)
+        except Exception:
+            abort(500)
+
+        # more than MAX_BULK_ROWS actors matched; none were deleted
+        if deleted is None:
+            abort(422)
+        return jsonify({
+            'success': True,
+            'deleted': deleted
+        })
+
     @app.route('/actors/<int:id>', methods=['PATCH'])
     @requires_auth('patch:actors')
+    @invalidates(Actor)
+    @admit('write')
     def patch_actor(jwt, id):
         """Update an actor Route"""
 
@@ -185,46 +560,122 @@ def create_app(test_config=None):
         age = data.get('age', None)
         gender = data.get('gender', None)
 
-        actor = Actor.query.get(id)
-
-        if actor is None:
-            abort(404)
-
         if name is None or age is None or gender is None:
             abort(400)
 
-        actor.name = name
-        actor.age = age
-        actor.gender = gender
-
+        # one UPDATE ... RETURNING; no row means no such actor
         try:
-            actor.update()
-            return jsonify({
-                'success': True,
-                'actor': actor.format()
-            }), 200
+            actor = Actor.update_row(
+                id, {'name': name, 'age': age, 'gender': gender},
+                FORMAT_FIELDS[Actor])
         except Exception:
             abort(500)
 
+        if actor is None:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'actor': actor
+        }), 200
+
     @app.route('/actors/<int:id>', methods=['DELETE'])
     @requires_auth('delete:actors')
+    @invalidates(Actor)
+    @admit('write')
     def delete_actor(jwt, id):
         """Delete an actor Route"""
-        actor = Actor.query.get(id)
-
-        if actor is None:
-            abort(404)
         try:
-            actor.delete()
-            return jsonify({
-                'success': True,
-                'message':
-                f'actor id {actor.id}, named {actor.name} was deleted',
-            })
+            actor = Actor.delete_row(id, ('id', 'name'))
         except Exception:
             db.session.rollback()
             abort(500)
 
+        if actor is None:
+            abort(404)
+        return jsonify({
+            'success': True,
+            'message':
+            f'actor id {actor["id"]}, named {actor["name"]} was deleted',
+        })
+
+    @app.route('/search')
+    @requires_auth()
+    @admit('read')
+    def search_catalog(jwt):
+        """Ranked search over movie titles and actor names route"""
+        # each half needs its own permission; a token with neither is
+        # rejected as for any other route
+        searched = [(model, key) for model, key, permission in (
+            (Movie, 'movies', 'get:movies'), (Actor, 'actors', 'get:actors'))
+            if permission in jwt['permissions']]
+        if not searched:
+            check_permissions('get:movies', jwt)
+
+        q = request.args.get('q', '').strip()
+        if not q:
+            abort(400)
+
+        limit, after = page_args()
+        offset = after[0] if after else 0
+        if not isinstance(offset, int) or offset < 0:
+            abort(400)
+
+        results = {'success': True}
+        more = False
+        for model, key in searched:
+            rows = search(model, q, limit, offset)
+            more = more or len(rows) > limit
+            results[key] = [
+                dict(item.format(), id=item.id, rank=round(float(rank), 4))
+                for item, rank in rows[:limit]]
+
+        results['next'] = encode_cursor([offset + limit]) if more else None
+        return jsonify(results), 200
+
+    @app.route('/stats')
+    @requires_auth('get:movies')
+    @admit('read')
+    def get_stats(jwt):
+        """Catalog statistics route"""
+        check_permissions('get:actors', jwt)
+        return jsonify({
+            'success': True,
+            'stats': load_stats(),
+        }), 200
+
+    @app.route('/health/pool')
+    def get_pool_stats():
+        """Database connection pool statistics route"""
+        replicas = app.extensions['replicas']
+        return jsonify({
+            'success': True,
+            'pool': pool_stats(),
+            'replicas': dict(replicas.stats(), pools=[
+                pool_stats(engine) for engine in replicas.engines]),
+            'admission': {
+                name: limiter.stats() for name, limiter in
+                app.extensions['admission'].items() if limiter is not None},
+            'response_cache': cache_stats(),
+            'jwks': auth.jwks_store.stats(),
+            'token_cache': auth.token_cache.stats(),
+        }), 200
+
+    @app.route('/health/ready')
+    def get_ready():
+        """Readiness route, 503 until this worker has warmed up"""
+        if not warmup.warm_up(app):
+            abort(503)
+        return jsonify({
+            'success': True,
+            'warm_up_ms': round(warmup.stats()['seconds'] * 1000, 1),
+        }), 200
+
+    @app.route('/metrics')
+    def get_metrics():
+        """Prometheus metrics route"""
+        body, content_type = metrics.exposition()
+        return Response(body, content_type=content_type)
+
     # Error Handling
     @app.errorhandler(422)
     def unprocessable(error):
@@ -244,11 +695,23 @@ def create_app(test_config=None):
 
     @app.errorhandler(400)
     def bad_request(error):
-        return jsonify({
+        body = {
             "success": False,
             "error": 400,
             "message": "bad request"
-        }), 400
+        }
+        # the invalid item of a batch
+        if getattr(error, 'index', None) is not None:
+            body['index'] = error.index
+        return jsonify(body), 400
+
+    @app.errorhandler(413)
+    def payload_too_large(error):
+        return jsonify({
+            "success": False,
+            "error": 413,
+            "message": "payload too large"
+        }), 413
 
     @app.errorhandler(500)
     def internal_server_error(error):
@@ -258,6 +721,17 @@ def create_app(test_config=None):
             "message": "internal server error"
         }), 500
 
+    @app.errorhandler(503)
+    def service_unavailable(error):
+        headers = {}
+        if getattr(error, 'retry_after', None) is not None:
+            headers['Retry-After'] = str(error.retry_after)
+        return jsonify({
+            "success": False,
+            "error": 503,
+            "message": "service unavailable"
+        }), 503, headers
+
     @app.errorhandler(AuthError)
     def handle_auth_error(exception):
         response = jsonify(exception.error)
@@ -267,7 +741,26 @@ def create_app(test_config=None):
     return app
 
 
-app = create_app()
+'''
+app
+    the application `gunicorn app:app` and `from app import app` get,
+    created on first access instead of at import, so importing this
+    module reads no configuration and does no I/O
+'''
+
+_app = None
+
+
+def __getattr__(name):
+    global _app
+    if name != 'app':
+        raise AttributeError(f'module {__name__!r} has no attribute {name!r}')
+    if _app is None:
+        _app = create_app()
+    return _app
+
 
 if __name__ == '__main__':
+    app = create_app()
+    warmup.warm_up(app)
     app.run()
@@ -0,0 +1,270 @@
+import asyncio
+import logging
+import os
+import re
+from urllib.parse import parse_qs
+
+from sqlalchemy import and_, select
+from sqlalchemy.dialects import postgresql
+from werkzeug.datastructures import MIMEAccept
+from werkzeug.exceptions import HTTPException
+from werkzeug.http import parse_accept_header
+
+from auth import (AuthError, parse_auth_header, decode_token,
+                  check_permissions, token_cache)
+from filters import (MOVIE_SORTS, ACTOR_SORTS, sort_keys, movie_filters,
+                     actor_filters)
+from models import Movie, Actor
+from pagination import (decode_cursor, encode_cursor, keyset_criterion,
+                        ordering, parse_limit)
+from projection import MOVIE_FIELDS, ACTOR_FIELDS, parse_fields
+from serializer import dumps as encode
+from streaming import NDJSON
+
+try:
+    import asyncpg
+except ImportError:
+    asyncpg = None
+
+'''
+ASGI read path
+    serves GET /movies, /movies/<id>, /actors and /actors/<id> on an
+    asyncio event loop with asyncpg, so a handful of processes can hold
+    thousands of concurrent keep-alive readers instead of one request per
+    sync worker. Statements are built from the same models, filters and
+    keyset pagination as app.py and compiled for asyncpg; auth goes
+    through the same token cache and permission check, with the blocking
+    RS256/JWKS path moved to a thread; responses are byte for byte what
+    jsonify produces.
+
+    Query parameters are read and validated as app.py reads them. List
+    requests for what only app.py serves, `?include=` and NDJSON
+    streaming, are a 400 rather than a different body for the same URL.
+
+    Writes stay on the Flask app. Run both behind the same proxy, e.g.
+        gunicorn app:app                 (everything)
+        uvicorn asgi:app --workers 2     (GET routes above)
+
+    requires the asyncpg and uvicorn packages
+'''
+
+logger = logging.getLogger(__name__)
+
+DIALECT = postgresql.dialect(paramstyle='numeric')
+PLACEHOLDER = re.compile(r'(?<![:\w]):(\d+)')
+POOL_SIZE = int(os.environ.get('ASYNC_DB_POOL_SIZE', 10))
+
+MESSAGES = {
+    400: 'bad request',
+    404: 'resource not found',
+    405: 'method not allowed',
+    500: 'internal server error',
+}
+
+RESOURCES = {
+    'movies': (Movie, 'movie', 'get:movies', MOVIE_SORTS, movie_filters,
+               MOVIE_FIELDS, ['id', 'title', 'release_date']),
+    'actors': (Actor, 'actor', 'get:actors', ACTOR_SORTS, actor_filters,
+               ACTOR_FIELDS, ['name', 'age', 'gender']),
+}
+
+ROUTE = re.compile(r'^/(movies|actors)(?:/(\d+))?/?$')
+
+_pool = None
+_pool_lock = None
+
+
+async def get_pool():
+    global _pool, _pool_lock
+    if _pool is None:
+        if asyncpg is None:
+            raise RuntimeError('the ASGI read path needs asyncpg installed')
+        if _pool_lock is None:
+            _pool_lock = asyncio.Lock()
+        async with _pool_lock:
+            if _pool is None:
+                _pool = await asyncpg.create_pool(
+                    os.environ['DATABASE_URL'], min_size=1,
+                    max_size=POOL_SIZE)
+    return _pool
+
+
+def compile_statement(statement):
+    '''
+    compiles a SQLAlchemy statement to asyncpg's $n placeholders
+    '''
+    compiled = statement.compile(dialect=DIALECT)
+    sql = PLACEHOLDER.sub(r'$\1', str(compiled))
+    return sql, [compiled.params[name] for name in compiled.positiontup]
+
+
+def dumps(data):
+    return encode(data) + b'\n'
+
+
+def error(status):
+    return status, dumps({
+        'success': False,
+        'error': status,
+        'message': MESSAGES[status],
+    })
+
+
+async def authorize(headers, permission):
+    auth = headers.get(b'authorization')
+    token = parse_auth_header(auth.decode('latin-1') if auth else None)
+    payload = token_cache.get(token)
+    if payload is None:
+        loop = asyncio.get_running_loop()
+        payload = await loop.run_in_executor(None, decode_token, token)
+    check_permissions(permission, payload)
+    return payload
+
+
+def query_params(query_string):
+    '''
+    the first value of each query parameter, blank ones included, as
+    flask's request.args.get sees them
+    '''
+    return {key: values[0] for key, values in parse_qs(
+        query_string.decode('latin-1'), keep_blank_values=True).items()}
+
+
+def unsupported(params, headers):
+    '''
+    whether a list request asks for an include or a streamed body, which
+    only app.py serves
+    '''
+    if 'include' in params or params.get('stream') in ('1', 'true'):
+        return True
+    accept = parse_accept_header(
+        headers.get(b'accept', b'').decode('latin-1'), MIMEAccept)
+    return accept.best_match(['application/json', NDJSON]) == NDJSON
+
+
+def page_params(params):
+    limit = parse_limit(params.get('limit'))
+    after = params.get('after')
+    if after is not None:
+        after = decode_cursor(after)
+    return limit, after
+
+
+def resource_fields(resource, params):
+    allowed, default = RESOURCES[resource][5:]
+    return parse_fields(allowed, params.get('fields')) or default
+
+
+async def get_list(pool, resource, params):
+    model, singular, permission, sorts, filters = RESOURCES[resource][:5]
+    fields = resource_fields(resource, params)
+    limit, after = page_params(params)
+
+    keys, descending = sort_keys(sorts, params.get('sort'))
+    columns = [getattr(model, field) for field in fields]
+    labels = [key.label(f'key_{i}') for i, key in enumerate(keys)]
+    criteria = filters(params)
+    if after is not None:
+        criteria.append(keyset_criterion(keys, after, descending))
+
+    statement = select(columns + labels)
+    if criteria:
+        statement = statement.where(and_(*criteria))
+    statement = statement.order_by(*ordering(keys, descending))
+    sql, args = compile_statement(statement.limit(limit + 1))
+
+    async with pool.acquire() as connection:
+        rows = await connection.fetch(sql, *args)
+    if len(rows) == 0:
+        return error(404)
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(
+            [rows[-1][label.name] for label in labels])
+    return 200, dumps({
+        'success': True,
+        resource: [{field: row[field] for field in fields} for row in rows],
+        'next': next_cursor,
+    })
+
+
+async def get_detail(pool, resource, id, params):
+    model, singular = RESOURCES[resource][:2]
+    fields = resource_fields(resource, params)
+    statement = select([getattr(model, field) for field in fields]).where(
+        model.id == id)
+    sql, args = compile_statement(statement)
+
+    async with pool.acquire() as connection:
+        row = await connection.fetchrow(sql, *args)
+    if row is None:
+        return error(404)
+    return 200, dumps({
+        'success': True,
+        singular: {field: row[field] for field in fields},
+    })
+
+
+async def handle(scope):
+    match = ROUTE.match(scope['path'])
+    if match is None:
+        return error(404)
+    if scope['method'] != 'GET':
+        return error(405)
+
+    resource, id = match.groups()
+    headers = dict(scope['headers'])
+    params = query_params(scope['query_string'])
+    try:
+        await authorize(headers, RESOURCES[resource][2])
+        if id is None and unsupported(params, headers):
+            return error(400)
+        pool = await get_pool()
+        if id is None:
+            return await get_list(pool, resource, params)
+        return await get_detail(pool, resource, int(id), params)
+    except AuthError as exception:
+        return exception.status_code, dumps(exception.error)
+    except HTTPException as exception:
+        return error(exception.code)
+
+
+async def lifespan(receive, send):
+    while True:
+        message = await receive()
+        if message['type'] == 'lifespan.startup':
+            await get_pool()
+            await send({'type': 'lifespan.startup.complete'})
+        elif message['type'] == 'lifespan.shutdown':
+            if _pool is not None:
+                await _pool.close()
+            await send({'type': 'lifespan.shutdown.complete'})
+            return
+
+
+async def app(scope, receive, send):
+    if scope['type'] == 'lifespan':
+        return await lifespan(receive, send)
+
+    try:
+        status, body = await handle(scope)
+    except Exception:
+        logger.exception('Exception on %s [%s]', scope['path'],
+                         scope['method'])
+        status, body = error(500)
+
+    await send({
+        'type': 'http.response.start',
+        'status': status,
+        'headers': [
+            (b'content-type', b'application/json'),
+            (b'content-length', str(len(body)).encode()),
+            (b'access-control-allow-headers',
+             b'Content-Type,Authorization,true'),
+            (b'access-control-allow-methods',
+             b'GET,PATCH,POST,DELETE,OPTIONS'),
+        ],
+    })
+    await send({'type': 'http.response.body', 'body': body})
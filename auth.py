@@ -1,15 +1,39 @@
+import hashlib
 import json
+import logging
+import threading
+import time
+from collections import OrderedDict
 from flask import request, _request_ctx_stack, abort, session, redirect
 from functools import wraps
 from jose import jwt
 from urllib.request import urlopen
+from background import BackgroundThread
+import metrics
 import os
 
 
-AUTH0_DOMAIN = os.environ['AUTH0_DOMAIN']
+# read from AUTH0_DOMAIN and AUTH0_JWKS_URL on first use, so importing this
+# module needs no configuration; setting them here overrides the environment
+AUTH0_DOMAIN = None
+AUTH0_JWKS_URL = None
 ALGORITHMS = ['RS256']
 API_AUDIENCE = 'image'
 
+logger = logging.getLogger(__name__)
+
+
+def auth0_domain():
+    return AUTH0_DOMAIN or os.environ['AUTH0_DOMAIN']
+
+
+def jwks_url():
+    # the signing keys are fetched from Auth0 unless pointed elsewhere, e.g.
+    # at the local key server of the load benchmark
+    return (AUTH0_JWKS_URL or os.environ.get('AUTH0_JWKS_URL') or
+            f'https://{auth0_domain()}/.well-known/jwks.json')
+
+
 # AuthError Exception
 '''
 AuthError Exception
@@ -36,7 +60,10 @@ class AuthError(Exception):
 
 
 def get_token_auth_header():
-    auth = request.headers.get('Authorization', None)
+    return parse_auth_header(request.headers.get('Authorization', None))
+
+
+def parse_auth_header(auth):
     if not auth:
         raise AuthError({
             'code': 'authorization_header_missing',
@@ -81,7 +108,7 @@ def check_permissions(permission, payload):
             'code': 'invalid_claims',
             'description': 'Permissions not included in JWT.'
         }, 400)
-    if permission not in payload['permissions']:
+    if permission and permission not in payload['permissions']:
         raise AuthError({
             'code': 'unauthorized',
             'description': 'Permission not found.'
@@ -89,6 +116,154 @@ def check_permissions(permission, payload):
     return True
 
 
+'''
+JWKSStore
+    in-process cache of the Auth0 signing keys, parsed into a kid -> key dict
+    the key set is loaded once at startup and refreshed in the background
+    every `ttl` seconds. An unknown kid forces a refetch, but at most once per
+    `min_refresh_interval` seconds, and kids that are still unknown after a
+    successful refetch are negative-cached for `negative_ttl` seconds so
+    bogus tokens cannot be used to hammer the IdP.
+'''
+
+
+class JWKSStore:
+    def __init__(self, ttl=None, min_refresh_interval=None,
+                 negative_ttl=None, max_negative=1024, timeout=5):
+        if ttl is None:
+            ttl = os.environ.get('JWKS_TTL', 3600)
+        if min_refresh_interval is None:
+            min_refresh_interval = os.environ.get(
+                'JWKS_MIN_REFRESH_INTERVAL', 30)
+        if negative_ttl is None:
+            negative_ttl = os.environ.get('JWKS_NEGATIVE_TTL', 300)
+        self.ttl = float(ttl)
+        self.min_refresh_interval = float(min_refresh_interval)
+        self.negative_ttl = float(negative_ttl)
+        self.max_negative = max_negative
+        self.timeout = timeout
+        self.keys = {}
+        self.counters = {
+            'hits': 0,
+            'misses': 0,
+            'negative_hits': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+        }
+        self._negative = OrderedDict()
+        self._fetched_at = None
+        self._lock = threading.Lock()
+        self._thread = BackgroundThread(
+            'jwks-refresh', self._refresh_loop, prepare=self._load)
+
+    @property
+    def url(self):
+        return jwks_url()
+
+    def fetch(self, url):
+        jsonurl = urlopen(url, timeout=self.timeout)
+        jwks = json.loads(jsonurl.read())
+        return {
+            key['kid']: {
+                'kty': key['kty'],
+                'kid': key['kid'],
+                'use': key['use'],
+                'n': key['n'],
+                'e': key['e']
+            }
+            for key in jwks['keys'] if 'kid' in key
+        }
+
+    def refresh(self):
+        '''
+        refetch the key set, keeping the current keys if Auth0 is unreachable
+        '''
+        self._fetched_at = time.monotonic()
+        # resolved once, in the try: without AUTH0_DOMAIN it raises too
+        url = None
+        try:
+            url = self.url
+            keys = self.fetch(url)
+        except Exception:
+            self.counters['refresh_errors'] += 1
+            logger.warning('Unable to refresh JWKS from %s', url,
+                           exc_info=True)
+            return False
+        self.keys = keys
+        self._negative.clear()
+        self.counters['refreshes'] += 1
+        return True
+
+    def start(self):
+        '''
+        load the key set (once) and start the background refresh thread
+        for the current process
+        '''
+        self._thread.start()
+
+    def _load(self):
+        with self._lock:
+            if self._fetched_at is None:
+                self.refresh()
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.ttl)
+            with self._lock:
+                self.refresh()
+
+    def refresh_if_allowed(self):
+        '''
+        refetch the key set unless it was fetched less than
+        `min_refresh_interval` seconds ago; returns whether it was refetched
+        '''
+        with self._lock:
+            return self._refresh_allowed() and self.refresh()
+
+    def get_key(self, kid):
+        self.start()
+        key = self.keys.get(kid)
+        if key is not None:
+            self.counters['hits'] += 1
+            return key
+
+        self.counters['misses'] += 1
+        expires = self._negative.get(kid)
+        if expires is not None and expires > time.monotonic():
+            self.counters['negative_hits'] += 1
+            return None
+
+        with self._lock:
+            # another thread may have refetched while we waited on the lock
+            key = self.keys.get(kid)
+            # only a refetch that succeeded and still lacks the kid proves
+            # it unknown; a rate-limited or failed one proves nothing
+            if (key is None and self._refresh_allowed() and
+                    self.refresh()):
+                key = self.keys.get(kid)
+                if key is None:
+                    self._remember_unknown(kid)
+        return key
+
+    def _refresh_allowed(self):
+        return (self._fetched_at is None or
+                time.monotonic() - self._fetched_at >=
+                self.min_refresh_interval)
+
+    def _remember_unknown(self, kid):
+        self._negative[kid] = time.monotonic() + self.negative_ttl
+        self._negative.move_to_end(kid)
+        while len(self._negative) > self.max_negative:
+            self._negative.popitem(last=False)
+
+    def stats(self):
+        return dict(self.counters, keys=len(self.keys),
+                    negative=len(self._negative))
+
+
+jwks_store = JWKSStore()
+
+
 '''
 @TODO implement verify_decode_jwt(token) method
     @INPUTS
@@ -102,96 +277,119 @@ def check_permissions(permission, payload):
 
 
 def verify_decode_jwt(token):
-    jsonurl = urlopen(f'https://{AUTH0_DOMAIN}/.well-known/jwks.json')
-    jwks = json.loads(jsonurl.read())
     unverified_header = jwt.get_unverified_header(token)
-    rsa_key = {}
 
     if 'kid' not in unverified_header:
-
         raise AuthError({
-
             'code': 'invalid_header',
-
             'description': 'Authorization malformed.'
-
         }, 401)
 
-    for key in jwks['keys']:
-
-        if key['kid'] == unverified_header['kid']:
-
-            rsa_key = {
-
-                'kty': key['kty'],
-
-                'kid': key['kid'],
-
-                'use': key['use'],
-
-                'n': key['n'],
-
-                'e': key['e']
-
-            }
-
-    if rsa_key:
-
-        try:
+    rsa_key = jwks_store.get_key(unverified_header['kid'])
 
-            payload = jwt.decode(
+    if rsa_key is None:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to find the appropriate key.'
+        }, 400)
 
-                token,
+    try:
+        payload = jwt.decode(
+            token,
+            rsa_key,
+            algorithms=ALGORITHMS,
+            audience=API_AUDIENCE,
+            issuer='https://' + auth0_domain() + '/'
+        )
+        return payload
+
+    except jwt.ExpiredSignatureError:
+        raise AuthError({
+            'code': 'token_expired',
+            'description': 'Token expired.'
+        }, 401)
 
-                rsa_key,
+    except jwt.JWTClaimsError:
+        raise AuthError({
+            'code': 'invalid_claims',
+            'description': 'Incorrect claims'
+        }, 401)
 
-                algorithms=ALGORITHMS,
+    except Exception:
+        raise AuthError({
+            'code': 'invalid_header',
+            'description': 'Unable to parse authentication token.'
+        }, 400)
 
-                audience=API_AUDIENCE,
 
-                issuer='https://' + AUTH0_DOMAIN + '/'
+'''
+TokenCache
+    bounded LRU of verified token payloads, keyed by a hash of the raw token
+    entries expire at the token's own `exp` claim, so a cached token is never
+    accepted after Auth0 would have rejected it. The `permissions` claim is
+    frozen into a frozenset once per token so check_permissions is O(1).
+    A max_size of 0 turns the cache off.
+'''
 
-            )
 
+class TokenCache:
+    def __init__(self, max_size=None):
+        if max_size is None:
+            max_size = os.environ.get('AUTH_TOKEN_CACHE_SIZE', 1024)
+        self.max_size = int(max_size)
+        self.counters = {'hits': 0, 'misses': 0, 'expired': 0}
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+
+    @staticmethod
+    def key(token):
+        return hashlib.sha256(token.encode()).digest()
+
+    def get(self, token):
+        if self.max_size <= 0:
+            return None
+        key = self.key(token)
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                self.counters['misses'] += 1
+                return None
+            exp, payload = entry
+            if exp <= time.time():
+                del self._entries[key]
+                self.counters['expired'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
             return payload
 
-        except jwt.ExpiredSignatureError:
-
-            raise AuthError({
-
-                'code': 'token_expired',
-
-                'description': 'Token expired.'
-
-            }, 401)
-
-        except jwt.JWTClaimsError:
-
-            raise AuthError({
-
-                'code': 'invalid_claims',
-
-                'description': 'Incorrect claims'
-
-            }, 401)
-
-        except Exception:
-
-            raise AuthError({
-
-                'code': 'invalid_header',
-
-                'description': 'Unable to parse authentication token.'
+    def put(self, token, payload):
+        '''
+        cache a verified payload and return the copy that should be used
+        '''
+        payload = dict(payload)
+        if 'permissions' in payload:
+            payload['permissions'] = frozenset(payload['permissions'])
+        exp = payload.get('exp')
+        if self.max_size <= 0 or not isinstance(exp, (int, float)):
+            return payload
+        key = self.key(token)
+        with self._lock:
+            self._entries[key] = (exp, payload)
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+        return payload
 
-            }, 400)
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
 
-            raise AuthError({
+    def stats(self):
+        return dict(self.counters, size=len(self._entries))
 
-                'code': 'invalid_header',
 
-                'description': 'Unable to find the appropriate key.'
-
-            }, 400)
+token_cache = TokenCache()
 
 
 '''
@@ -203,19 +401,34 @@ def verify_decode_jwt(token):
 '''
 
 
+def decode_token(token):
+    '''
+    returns the verified payload of a token, from the token cache when
+    it has been seen before
+    '''
+    payload = token_cache.get(token)
+    if payload is None:
+        try:
+            payload = token_cache.put(token, verify_decode_jwt(token))
+        except Exception:
+            raise AuthError({
+                'code': 'invalid_token',
+                'description': 'Access denied due to invalid token'
+            }, 401)
+    return payload
+
+
 def requires_auth(permission=''):
     def requires_auth_decorator(f):
         @wraps(f)
         def wrapper(*args, **kwargs):
-            token = get_token_auth_header()
+            start = time.perf_counter()
             try:
-                payload = verify_decode_jwt(token)
-            except Exception:
-                raise AuthError({
-                    'code': 'invalid_token',
-                    'description': 'Access denied due to invalid token'
-                }, 401)
-            check_permissions(permission, payload)
+                token = get_token_auth_header()
+                payload = decode_token(token)
+                check_permissions(permission, payload)
+            finally:
+                metrics.add('auth', time.perf_counter() - start)
             return f(payload, *args, **kwargs)
 
         return wrapper
@@ -0,0 +1,37 @@
+import os
+import threading
+
+'''
+BackgroundThread
+    a daemon thread that runs `target` once per process. start() is safe
+    to call repeatedly and from any thread, and starts a new thread after
+    a fork, in which only the thread that forked survives. `prepare`, if
+    given, runs just before the thread starts in a process, e.g. to load
+    initial state or drop what was inherited from the parent.
+'''
+
+
+class BackgroundThread:
+    def __init__(self, name, target, prepare=None):
+        self.name = name
+        self.target = target
+        self.prepare = prepare
+        self.thread = None
+        self.pid = None
+        self._lock = threading.Lock()
+
+    def running(self):
+        return self.pid == os.getpid()
+
+    def start(self):
+        if self.running():
+            return
+        with self._lock:
+            if self.running():
+                return
+            if self.prepare is not None:
+                self.prepare()
+            self.thread = threading.Thread(
+                target=self.target, name=self.name, daemon=True)
+            self.thread.start()
+            self.pid = os.getpid()
@@ -0,0 +1,96 @@
+'''
+Sync vs async read path benchmark
+    drives the same GET route on two running servers with many concurrent
+    keep-alive connections and reports throughput and latency for each,
+    e.g. the Flask app under gunicorn against asgi.py under uvicorn:
+
+        gunicorn -w 4 -b 127.0.0.1:8000 app:app
+        uvicorn --workers 4 --port 8001 asgi:app
+        python -m benchmarks.async_reads --token $TOKEN \\
+            http://127.0.0.1:8000 http://127.0.0.1:8001
+
+    TOKEN must be accepted by both servers and carry the permission of
+    the benchmarked route.
+'''
+import argparse
+import asyncio
+import statistics
+import time
+from urllib.parse import urlsplit
+
+
+async def client(host, port, request, deadline, latencies, errors):
+    reader, writer = await asyncio.open_connection(host, port)
+    try:
+        while time.perf_counter() < deadline:
+            start = time.perf_counter()
+            writer.write(request)
+            await writer.drain()
+            status = int((await reader.readline()).split()[1])
+            length = 0
+            while True:
+                line = await reader.readline()
+                if line in (b'\r\n', b''):
+                    break
+                name, _, value = line.partition(b':')
+                if name.lower() == b'content-length':
+                    length = int(value)
+            await reader.readexactly(length)
+            if status >= 400:
+                errors.append(status)
+            else:
+                latencies.append(time.perf_counter() - start)
+    except (ConnectionError, asyncio.IncompleteReadError) as exception:
+        errors.append(type(exception).__name__)
+    finally:
+        writer.close()
+
+
+async def run(url, path, token, connections, duration):
+    parts = urlsplit(url)
+    request = (f'GET {path} HTTP/1.1\r\n'
+               f'Host: {parts.netloc}\r\n'
+               f'Authorization: Bearer {token}\r\n'
+               f'Connection: keep-alive\r\n\r\n').encode()
+    latencies, errors = [], []
+    deadline = time.perf_counter() + duration
+    await asyncio.gather(*(
+        client(parts.hostname, parts.port or 80, request, deadline,
+               latencies, errors)
+        for _ in range(connections)))
+    return latencies, errors
+
+
+def report(url, latencies, errors, duration):
+    count = len(latencies)
+    latencies = sorted(latencies) or [0.0]
+
+    def percentile(fraction):
+        index = min(len(latencies) - 1, int(len(latencies) * fraction))
+        return latencies[index] * 1000
+
+    print(f'{url}')
+    print(f'  requests {count:>9,}   errors {len(errors):,}')
+    print(f'  rps      {count / duration:>9,.0f}')
+    print(f'  p50 {percentile(0.50):.1f}ms  p95 {percentile(0.95):.1f}ms  '
+          f'p99 {percentile(0.99):.1f}ms  '
+          f'mean {statistics.mean(latencies) * 1000:.1f}ms')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('urls', nargs='+')
+    parser.add_argument('--token', required=True)
+    parser.add_argument('--path', default='/movies?limit=20')
+    parser.add_argument('--connections', type=int, default=500)
+    parser.add_argument('--duration', type=float, default=20)
+    args = parser.parse_args()
+
+    for url in args.urls:
+        latencies, errors = asyncio.run(run(
+            url, args.path, args.token, args.connections, args.duration))
+        report(url, latencies, errors, args.duration)
+
+
+if __name__ == '__main__':
+    main()
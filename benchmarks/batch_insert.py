@@ -0,0 +1,61 @@
+'''
+Batch insert benchmark
+    compares creating N movies through the per-row path (Movie.insert,
+    one transaction per row, as POST /movies does) with one
+    Movie.insert_many call (as POST /movies/batch does).
+
+    python -m benchmarks.batch_insert [rows]
+
+    runs against DATABASE_URL and deletes the rows it created afterwards.
+'''
+import datetime
+import sys
+import time
+
+from flask import Flask
+
+from models import setup_db, db, Movie
+
+
+def per_row(count):
+    ids = []
+    for i in range(count):
+        movie = Movie(title=f'bench {i}',
+                      release_date=datetime.datetime(2020, 1, 1))
+        movie.insert()
+        ids.append(movie.id)
+    return ids
+
+
+def batched(count):
+    rows = [{'title': f'bench {i}',
+             'release_date': datetime.datetime(2020, 1, 1)}
+            for i in range(count)]
+    return [movie['id'] for movie in Movie.insert_many(rows)]
+
+
+def timed(fn, count):
+    start = time.perf_counter()
+    ids = fn(count)
+    elapsed = time.perf_counter() - start
+    Movie.query.filter(Movie.id.in_(ids)).delete(synchronize_session=False)
+    db.session.commit()
+    return elapsed
+
+
+def main(count):
+    app = Flask(__name__)
+    setup_db(app)
+    with app.app_context():
+        db.create_all()
+        row_time = timed(per_row, count)
+        batch_time = timed(batched, count)
+
+    print(f'rows:      {count}')
+    print(f'per-row:   {row_time:.3f}s  {count / row_time:,.0f} rows/s')
+    print(f'batch:     {batch_time:.3f}s  {count / batch_time:,.0f} rows/s')
+    print(f'speedup:   {row_time / batch_time:.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000)
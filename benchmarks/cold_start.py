@@ -0,0 +1,187 @@
+'''
+Cold start benchmark
+    measures the first requests a fresh deploy serves. For each profile a
+    new gunicorn is started, and as soon as its socket accepts
+    connections, then --settle seconds later, `--concurrency` clients
+    send the first `--requests` read requests between them:
+
+        cold    gunicorn's defaults without gunicorn.conf.py: sync
+                workers, each importing the app itself and connecting,
+                fetching the signing keys and starting its threads on
+                its first requests
+        warm    gunicorn.conf.py: the app preloaded, gthread workers that
+                warm up before they accept connections
+
+    and p50/p99/max latency of those requests are compared. No request
+    is sent before the measured ones, since any probe would warm a
+    worker up.
+
+    python -m benchmarks.cold_start [--workers 4] [--requests 200]
+        [--concurrency 8] [--settle 3] [--jwks-latency 150]
+        [--output results.json]
+
+    the local JWKS server answers after --jwks-latency milliseconds, the
+    round trip to Auth0 a real first request pays.
+
+    runs against DATABASE_URL (use a scratch database) and deletes the
+    rows it created afterwards.
+'''
+import argparse
+import json
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter
+from urllib.parse import urlsplit
+
+from benchmarks.jwks_server import JWKSServer
+from benchmarks.load import (OPERATIONS, ROOT, Client, cleanup, commit,
+                             seed, summarize)
+from benchmarks.tokens import ROLES, load_key, mint
+
+PROFILES = ('cold', 'warm')
+
+
+def wait_listening(base, process, timeout=60):
+    '''
+    wait for gunicorn's socket without sending it a request
+    '''
+    parts = urlsplit(base)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {process.returncode}')
+        try:
+            socket.create_connection((parts.hostname, parts.port), 1).close()
+            return
+        except OSError:
+            time.sleep(0.05)
+    raise RuntimeError(f'{base} did not start listening')
+
+
+def first_requests(args, profile, tokens, catalog, env, directory):
+    base = f'http://{args.bind}'
+    command = [sys.executable, '-c',
+               'from gunicorn.app.wsgiapp import run; run()',
+               '--workers', str(args.workers), '--bind', args.bind,
+               '--log-level', 'warning']
+    if profile == 'cold':
+        # an empty configuration file leaves gunicorn on its defaults
+        empty = os.path.join(directory, 'cold.conf.py')
+        open(empty, 'w').close()
+        command += ['--config', empty]
+    process = subprocess.Popen(command + ['app:app'], cwd=ROOT, env=env)
+    try:
+        wait_listening(base, process)
+        time.sleep(args.settle)
+        clients = [Client(base, tokens, catalog, 'read', seed)
+                   for seed in range(args.concurrency)]
+        for client in clients:
+            client.recording = True
+        shares = [args.requests // args.concurrency +
+                  (index < args.requests % args.concurrency)
+                  for index in range(args.concurrency)]
+
+        def send(client, count):
+            for _ in range(count):
+                route = client.rng.choices(
+                    client.routes, cum_weights=client.cumulative)[0]
+                getattr(client, OPERATIONS[route])()
+
+        start = time.perf_counter()
+        threads = [threading.Thread(target=send, args=(client, count))
+                   for client, count in zip(clients, shares)]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+        duration = time.perf_counter() - start
+    finally:
+        process.terminate()
+        process.wait(30)
+
+    latencies, statuses = [], Counter()
+    for client in clients:
+        for values in client.latencies.values():
+            latencies.extend(values)
+        for counts in client.statuses.values():
+            statuses.update(counts)
+    result = summarize(latencies, statuses, duration)
+    result['max_ms'] = round(max(latencies) * 1000, 2) if latencies else None
+    return result
+
+
+def run(args):
+    domain = os.environ.get('AUTH0_DOMAIN', 'benchmark.local')
+    with tempfile.TemporaryDirectory() as directory:
+        key = load_key(os.path.join(directory, 'key.pem'))
+        tokens = {role: mint(key, role, domain=domain) for role in ROLES}
+        jwks_server = JWKSServer(key, latency=args.jwks_latency / 1000)
+        jwks_server.start()
+        env = dict(os.environ, AUTH0_DOMAIN=domain,
+                   AUTH0_JWKS_URL=jwks_server.url)
+        catalog = seed(args.movies, args.actors, args.cast)
+        profiles = {}
+        try:
+            for profile in PROFILES:
+                fetches = jwks_server.fetches
+                profiles[profile] = first_requests(
+                    args, profile, tokens, catalog, env, directory)
+                profiles[profile]['jwks_fetches'] = (
+                    jwks_server.fetches - fetches)
+        finally:
+            jwks_server.shutdown()
+            cleanup(catalog)
+    return {
+        'commit': commit(),
+        'config': {name: value for name, value in vars(args).items()
+                   if name != 'output'},
+        'profiles': profiles,
+    }
+
+
+def report(results):
+    config = results['config']
+    print(f'commit {results["commit"]}  first {config["requests"]} '
+          f'requests  {config["concurrency"]} clients  '
+          f'{config["workers"]} workers')
+    print(f'{"profile":<8} {"errors":>7} {"p50 ms":>9} {"p95 ms":>9} '
+          f'{"p99 ms":>9} {"max ms":>9} {"jwks":>5}')
+    for profile, summary in results['profiles'].items():
+        print(f'{profile:<8} {summary["errors"]:>7} '
+              f'{summary["p50_ms"] or 0:>9} {summary["p95_ms"] or 0:>9} '
+              f'{summary["p99_ms"] or 0:>9} {summary["max_ms"] or 0:>9} '
+              f'{summary["jwks_fetches"]:>5}')
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--requests', type=int, default=200)
+    parser.add_argument('--concurrency', type=int, default=8)
+    parser.add_argument('--settle', type=float, default=3,
+                        help='seconds between listening and the requests')
+    parser.add_argument('--jwks-latency', type=float, default=150,
+                        help='milliseconds each key set fetch takes, as '
+                        'it would from Auth0')
+    parser.add_argument('--bind', default='127.0.0.1:8766')
+    parser.add_argument('--movies', type=int, default=200)
+    parser.add_argument('--actors', type=int, default=200)
+    parser.add_argument('--cast', type=int, default=3)
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    results = run(args)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,76 @@
+'''
+Local JWKS server
+    serves the public key of benchmarks.tokens at
+    /.well-known/jwks.json, standing in for Auth0 so tokens minted with
+    the same key file are accepted by an API started with
+
+        AUTH0_JWKS_URL=http://127.0.0.1:8099/.well-known/jwks.json
+
+    python -m benchmarks.jwks_server --key bench-key.pem [--port 8099]
+'''
+import argparse
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+from benchmarks.tokens import jwks, load_key
+
+JWKS_PATH = '/.well-known/jwks.json'
+
+
+class JWKSServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, key, address=('127.0.0.1', 0), latency=0):
+        super().__init__(address, JWKSHandler)
+        self.body = json.dumps(jwks(key)).encode()
+        self.latency = latency
+        self.fetches = 0
+
+    @property
+    def url(self):
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}{JWKS_PATH}'
+
+    def start(self):
+        '''
+        serve from a daemon thread
+        '''
+        thread = threading.Thread(target=self.serve_forever,
+                                  name='jwks-server', daemon=True)
+        thread.start()
+        return thread
+
+
+class JWKSHandler(BaseHTTPRequestHandler):
+    def do_GET(self):
+        if self.path != JWKS_PATH:
+            self.send_error(404)
+            return
+        self.server.fetches += 1
+        # the round trip to Auth0 this stands in for
+        time.sleep(self.server.latency)
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(self.server.body)))
+        self.end_headers()
+        self.wfile.write(self.server.body)
+
+    def log_message(self, format, *args):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser(description='serve a local JWKS')
+    parser.add_argument('--key', default='bench-key.pem')
+    parser.add_argument('--host', default='127.0.0.1')
+    parser.add_argument('--port', type=int, default=8099)
+    args = parser.parse_args()
+    server = JWKSServer(load_key(args.key), (args.host, args.port))
+    print(f'AUTH0_JWKS_URL={server.url}')
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
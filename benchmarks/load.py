@@ -0,0 +1,502 @@
+'''
+Load benchmark
+    runs create_app() under gunicorn the way it is deployed, with a local
+    JWKS server standing in for Auth0 and tokens minted for each role,
+    seeds movies, actors and casting, then drives a weighted mix of read
+    and write requests from `--concurrency` keep-alive clients. Reports
+    throughput and p50/p95/p99 latency per route and writes them as JSON
+    so runs can be compared between commits.
+
+    python -m benchmarks.load [--mix read|mixed|write] [--duration 30]
+        [--concurrency 16] [--workers 4] [--threads 1]
+        [--output results.json]
+    python -m benchmarks.load compare before.json after.json
+
+    runs against DATABASE_URL (use a scratch database) and deletes the
+    rows it created afterwards.
+'''
+import argparse
+import datetime
+import http.client
+import json
+import os
+import random
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+from collections import Counter, defaultdict
+from itertools import accumulate
+from urllib.parse import urlsplit
+
+from benchmarks.jwks_server import JWKSServer
+from benchmarks.tokens import ROLES, load_key, mint
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+WORDS = ('night', 'river', 'city', 'dream', 'storm', 'garden', 'shadow',
+         'winter', 'empire', 'signal')
+
+READS = {
+    'GET /movies': 25,
+    'GET /movies/<id>': 25,
+    'GET /actors': 15,
+    'GET /actors/<id>': 15,
+    'GET /movies/<id>/actors': 10,
+    'GET /search': 7,
+    'GET /stats': 3,
+}
+WRITES = {
+    'POST /movies': 20,
+    'PATCH /movies/<id>': 15,
+    'DELETE /movies/<id>': 15,
+    'POST /actors/batch': 15,
+    'PATCH /actors/<id>': 10,
+    'DELETE /actors/<id>': 10,
+    'POST /movies/<id>/actors': 15,
+}
+# the share of requests that are reads
+MIXES = {'read': 1.0, 'mixed': 0.9, 'write': 0.5}
+
+
+def weights(mix):
+    reads = MIXES[mix]
+    weighted = {route: weight * reads for route, weight in READS.items()}
+    if reads < 1:
+        weighted.update({route: weight * (1 - reads)
+                         for route, weight in WRITES.items()})
+    return weighted
+
+
+'''
+Catalog
+    the seeded rows the clients read and update
+'''
+
+
+class Catalog:
+    def __init__(self, movies, actors):
+        self.movies = movies
+        self.actors = actors
+        self.created = {'movies': set(), 'actors': set()}
+        self._lock = threading.Lock()
+
+    def add(self, table, id):
+        with self._lock:
+            self.created[table].add(id)
+
+    def discard(self, table, id):
+        with self._lock:
+            self.created[table].discard(id)
+
+
+def seed(movies, actors, cast):
+    '''
+    insert the benchmark rows and return the Catalog of them
+    '''
+    from flask import Flask
+    from models import setup_db, db, casting, Movie, Actor
+
+    app = Flask(__name__)
+    setup_db(app)
+    rng = random.Random(0)
+    with app.app_context():
+        # a scratch SQLite database cannot run the PostgreSQL migrations
+        db.create_all()
+        created = Movie.insert_many([{
+            'title': f'{WORDS[i % len(WORDS)]} {i}',
+            'release_date': datetime.datetime(1950 + i % 70, 1 + i % 12, 1),
+        } for i in range(movies)])
+        movie_rows = [(row['id'], row['title'], row['release_date'])
+                      for row in created]
+        created = Actor.insert_many([{
+            'name': f'{WORDS[-1 - i % len(WORDS)]} actor {i}',
+            'age': str(18 + i % 60),
+            'gender': ('female', 'male')[i % 2],
+        } for i in range(actors)])
+        actor_rows = [(row['id'], row['name'], row['age'], row['gender'])
+                      for row in created]
+        pairs = {(movie[0], actor[0])
+                 for movie in movie_rows
+                 for actor in rng.sample(actor_rows, min(cast, actors))}
+        if pairs:
+            db.session.execute(casting.insert(), [
+                {'movie_id': movie_id, 'actor_id': actor_id}
+                for movie_id, actor_id in pairs])
+            db.session.commit()
+    return Catalog(movie_rows, actor_rows)
+
+
+def cleanup(catalog):
+    from flask import Flask
+    from models import setup_db, db, casting, Movie, Actor
+
+    app = Flask(__name__)
+    setup_db(app)
+    movie_ids = [row[0] for row in catalog.movies] + list(
+        catalog.created['movies'])
+    actor_ids = [row[0] for row in catalog.actors] + list(
+        catalog.created['actors'])
+    with app.app_context():
+        # casting rows go first; SQLite does not cascade the deletes
+        db.session.execute(casting.delete().where(
+            casting.c.movie_id.in_(movie_ids) |
+            casting.c.actor_id.in_(actor_ids)))
+        Movie.query.filter(Movie.id.in_(movie_ids)).delete(
+            synchronize_session=False)
+        Actor.query.filter(Actor.id.in_(actor_ids)).delete(
+            synchronize_session=False)
+        db.session.commit()
+
+
+'''
+Client
+    one keep-alive connection issuing requests picked from the mix
+'''
+
+
+class Client:
+    def __init__(self, base, tokens, catalog, mix, seed):
+        parts = urlsplit(base)
+        self.connection = http.client.HTTPConnection(
+            parts.hostname, parts.port, timeout=30)
+        self.tokens = tokens
+        self.catalog = catalog
+        self.rng = random.Random(seed)
+        mix = weights(mix)
+        self.routes = list(mix)
+        self.cumulative = list(accumulate(mix.values()))
+        self.latencies = defaultdict(list)
+        self.statuses = defaultdict(Counter)
+        self.recording = False
+        # rows this client created and may delete or cast
+        self.movies = []
+        self.actors = []
+        self.uncast = []
+
+    def request(self, route, method, path, role, body=None):
+        headers = {'Authorization': f'Bearer {self.tokens[role]}'}
+        if body is not None:
+            body = json.dumps(body)
+            headers['Content-Type'] = 'application/json'
+        start = time.perf_counter()
+        try:
+            self.connection.request(method, path, body=body, headers=headers)
+            response = self.connection.getresponse()
+            payload = response.read()
+        except (OSError, http.client.HTTPException):
+            # the next request reconnects
+            self.connection.close()
+            if self.recording:
+                self.statuses[route]['error'] += 1
+            return None
+        if self.recording:
+            self.latencies[route].append(time.perf_counter() - start)
+            self.statuses[route][str(response.status)] += 1
+        if response.status >= 400:
+            return None
+        return json.loads(payload)
+
+    def run(self, stop):
+        while not stop.is_set():
+            route = self.rng.choices(self.routes,
+                                     cum_weights=self.cumulative)[0]
+            getattr(self, OPERATIONS[route])()
+
+    def movie(self):
+        return self.rng.choice(self.catalog.movies)
+
+    def actor(self):
+        return self.rng.choice(self.catalog.actors)
+
+    def get_movies(self):
+        self.request('GET /movies', 'GET', '/movies?limit=20', 'assistant')
+
+    def get_movie(self):
+        self.request('GET /movies/<id>', 'GET',
+                     f'/movies/{self.movie()[0]}', 'assistant')
+
+    def get_actors(self):
+        self.request('GET /actors', 'GET', '/actors?limit=20', 'assistant')
+
+    def get_actor(self):
+        self.request('GET /actors/<id>', 'GET',
+                     f'/actors/{self.actor()[0]}', 'assistant')
+
+    def get_movie_actors(self):
+        self.request('GET /movies/<id>/actors', 'GET',
+                     f'/movies/{self.movie()[0]}/actors', 'assistant')
+
+    def search(self):
+        self.request('GET /search', 'GET',
+                     f'/search?q={self.rng.choice(WORDS)}', 'assistant')
+
+    def get_stats(self):
+        self.request('GET /stats', 'GET', '/stats', 'assistant')
+
+    def post_movie(self):
+        data = self.request('POST /movies', 'POST', '/movies', 'producer', {
+            'title': f'{self.rng.choice(WORDS)} new',
+            'release_date': '2020-01-01',
+        })
+        if data is not None:
+            self.movies.append(data['movie']['id'])
+            self.catalog.add('movies', data['movie']['id'])
+
+    def patch_movie(self):
+        id, title, release_date = self.movie()
+        self.request('PATCH /movies/<id>', 'PATCH', f'/movies/{id}',
+                     'director', {'title': title,
+                                  'release_date': release_date.isoformat()})
+
+    def delete_movie(self):
+        if not self.movies:
+            return self.post_movie()
+        id = self.movies.pop()
+        if self.request('DELETE /movies/<id>', 'DELETE', f'/movies/{id}',
+                        'producer') is not None:
+            self.catalog.discard('movies', id)
+
+    def post_actor(self):
+        # POST /actors does not return the new id; a batch of one does
+        data = self.request('POST /actors/batch', 'POST', '/actors/batch',
+                            'director', [{
+                                'name': f'{self.rng.choice(WORDS)} new',
+                                'age': '30', 'gender': 'female'}])
+        if data is not None:
+            id = data['actors'][0]['id']
+            self.actors.append(id)
+            self.uncast.append(id)
+            self.catalog.add('actors', id)
+
+    def patch_actor(self):
+        id, name, age, gender = self.actor()
+        self.request('PATCH /actors/<id>', 'PATCH', f'/actors/{id}',
+                     'director', {'name': name, 'age': age, 'gender': gender})
+
+    def delete_actor(self):
+        if not self.actors:
+            return self.post_actor()
+        id = self.actors.pop()
+        if id in self.uncast:
+            self.uncast.remove(id)
+        if self.request('DELETE /actors/<id>', 'DELETE', f'/actors/{id}',
+                        'director') is not None:
+            self.catalog.discard('actors', id)
+
+    def cast(self):
+        if not self.uncast:
+            return self.post_actor()
+        self.request('POST /movies/<id>/actors', 'POST',
+                     f'/movies/{self.movie()[0]}/actors', 'director',
+                     {'actor_id': self.uncast.pop()})
+
+
+OPERATIONS = {
+    'GET /movies': 'get_movies',
+    'GET /movies/<id>': 'get_movie',
+    'GET /actors': 'get_actors',
+    'GET /actors/<id>': 'get_actor',
+    'GET /movies/<id>/actors': 'get_movie_actors',
+    'GET /search': 'search',
+    'GET /stats': 'get_stats',
+    'POST /movies': 'post_movie',
+    'PATCH /movies/<id>': 'patch_movie',
+    'DELETE /movies/<id>': 'delete_movie',
+    'POST /actors/batch': 'post_actor',
+    'PATCH /actors/<id>': 'patch_actor',
+    'DELETE /actors/<id>': 'delete_actor',
+    'POST /movies/<id>/actors': 'cast',
+}
+
+
+def summarize(latencies, statuses, duration):
+    latencies = sorted(latencies)
+    count = sum(statuses.values())
+    errors = sum(number for status, number in statuses.items()
+                 if status == 'error' or int(status) >= 400)
+
+    def percentile(fraction):
+        if not latencies:
+            return None
+        index = min(len(latencies) - 1, int(len(latencies) * fraction))
+        return round(latencies[index] * 1000, 2)
+
+    return {
+        'requests': count,
+        'errors': errors,
+        'rps': round(count / duration, 1),
+        'p50_ms': percentile(0.50),
+        'p95_ms': percentile(0.95),
+        'p99_ms': percentile(0.99),
+        'mean_ms': (round(sum(latencies) / len(latencies) * 1000, 2)
+                    if latencies else None),
+        'statuses': dict(sorted(statuses.items())),
+    }
+
+
+def wait_ready(base, process, timeout=60):
+    parts = urlsplit(base)
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f'gunicorn exited with {process.returncode}')
+        try:
+            connection = http.client.HTTPConnection(
+                parts.hostname, parts.port, timeout=1)
+            connection.request('GET', '/health/ready')
+            if connection.getresponse().status == 200:
+                return
+        except OSError:
+            pass
+        time.sleep(0.2)
+    raise RuntimeError(f'{base} did not become ready')
+
+
+def commit():
+    try:
+        return subprocess.run(
+            ['git', 'rev-parse', '--short', 'HEAD'], cwd=ROOT, check=True,
+            capture_output=True, text=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def run(args):
+    domain = os.environ.get('AUTH0_DOMAIN', 'benchmark.local')
+    with tempfile.TemporaryDirectory() as directory:
+        key = load_key(args.key or os.path.join(directory, 'key.pem'))
+    tokens = {role: mint(key, role, domain=domain) for role in ROLES}
+    jwks_server = JWKSServer(key)
+    jwks_server.start()
+
+    catalog = seed(args.movies, args.actors, args.cast)
+    base = f'http://{args.bind}'
+    env = dict(os.environ, AUTH0_DOMAIN=domain,
+               AUTH0_JWKS_URL=jwks_server.url)
+    # gunicorn's own entry point, run by this interpreter
+    process = subprocess.Popen(
+        [sys.executable, '-c',
+         'from gunicorn.app.wsgiapp import run; run()',
+         '--workers', str(args.workers),
+         '--threads', str(args.threads), '--bind', args.bind,
+         '--log-level', 'warning', 'app:app'],
+        cwd=ROOT, env=env)
+    try:
+        wait_ready(base, process)
+        clients = [Client(base, tokens, catalog, args.mix, seed)
+                   for seed in range(args.concurrency)]
+        stop = threading.Event()
+        threads = [threading.Thread(target=client.run, args=(stop,))
+                   for client in clients]
+        for thread in threads:
+            thread.start()
+        time.sleep(args.warmup)
+        for client in clients:
+            client.recording = True
+        start = time.perf_counter()
+        time.sleep(args.duration)
+        for client in clients:
+            client.recording = False
+        duration = time.perf_counter() - start
+        stop.set()
+        for thread in threads:
+            thread.join()
+    finally:
+        process.terminate()
+        process.wait(30)
+        jwks_server.shutdown()
+        cleanup(catalog)
+
+    latencies, statuses = defaultdict(list), defaultdict(Counter)
+    for client in clients:
+        for route, values in client.latencies.items():
+            latencies[route].extend(values)
+        for route, counts in client.statuses.items():
+            statuses[route].update(counts)
+    return {
+        'commit': commit(),
+        'date': datetime.datetime.now(datetime.timezone.utc).isoformat(),
+        'config': {name: value for name, value in vars(args).items()
+                   if name not in ('command', 'files', 'output', 'key')},
+        'duration_s': round(duration, 2),
+        'jwks_fetches': jwks_server.fetches,
+        'routes': {route: summarize(latencies[route], statuses[route],
+                                    duration)
+                   for route in sorted(statuses)},
+        'total': summarize(
+            [value for values in latencies.values() for value in values],
+            sum(statuses.values(), Counter()), duration),
+    }
+
+
+def report(results):
+    print(f'commit {results["commit"]}  {results["config"]["mix"]} mix  '
+          f'{results["duration_s"]}s  '
+          f'{results["config"]["concurrency"]} clients  '
+          f'{results["config"]["workers"]} workers')
+    print(f'{"route":<26} {"requests":>9} {"errors":>7} {"rps":>8} '
+          f'{"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+    rows = list(results['routes'].items()) + [('total', results['total'])]
+    for route, summary in rows:
+        print(f'{route:<26} {summary["requests"]:>9} {summary["errors"]:>7} '
+              f'{summary["rps"]:>8} {summary["p50_ms"] or 0:>8} '
+              f'{summary["p95_ms"] or 0:>8} {summary["p99_ms"] or 0:>8}')
+
+
+def compare(before, after):
+    print(f'{"route":<26} {"rps":>18} {"p95 ms":>18} {"p99 ms":>18}')
+
+    def change(old, new):
+        if not old or new is None:
+            return f'{"-":>18}'
+        return f'{new:>9.2f} {(new - old) / old:>+7.1%} '
+
+    routes = sorted(set(before['routes']) | set(after['routes']))
+    for route in routes + ['total']:
+        old = before['total'] if route == 'total' else before[
+            'routes'].get(route, {})
+        new = after['total'] if route == 'total' else after[
+            'routes'].get(route, {})
+        print(f'{route:<26} ' + ' '.join(
+            change(old.get(name), new.get(name))
+            for name in ('rps', 'p95_ms', 'p99_ms')))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.split('\n')[1])
+    parser.add_argument('command', nargs='?', default='run',
+                        choices=('run', 'compare'))
+    parser.add_argument('files', nargs='*')
+    parser.add_argument('--mix', default='mixed', choices=list(MIXES))
+    parser.add_argument('--duration', type=float, default=30)
+    parser.add_argument('--warmup', type=float, default=3)
+    parser.add_argument('--concurrency', type=int, default=16)
+    parser.add_argument('--workers', type=int, default=4)
+    parser.add_argument('--threads', type=int, default=1)
+    parser.add_argument('--bind', default='127.0.0.1:8765')
+    parser.add_argument('--movies', type=int, default=1000)
+    parser.add_argument('--actors', type=int, default=1000)
+    parser.add_argument('--cast', type=int, default=3,
+                        help='actors cast in each movie')
+    parser.add_argument('--key', help='signing key file, kept between runs')
+    parser.add_argument('--output', help='write the results as JSON')
+    args = parser.parse_args()
+
+    if args.command == 'compare':
+        if len(args.files) != 2:
+            parser.error('compare takes two result files')
+        with open(args.files[0]) as before, open(args.files[1]) as after:
+            compare(json.load(before), json.load(after))
+        return
+
+    results = run(args)
+    report(results)
+    if args.output:
+        with open(args.output, 'w') as output:
+            json.dump(results, output, indent=2, sort_keys=True)
+            output.write('\n')
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,75 @@
+'''
+Metrics overhead benchmark
+    times the instrumentation a request goes through: the request start
+    hooks, the auth and serialize timers, the SQL statement hooks of
+    queries.py for `statements` statements and record_request, against a
+    matched route inside a request context, next to the cost of a whole
+    no-op request through the WSGI app for scale.
+
+    python -m benchmarks.metrics_overhead [requests] [statements]
+    prometheus_multiproc_dir=$(mktemp -d) python -m benchmarks.metrics_overhead
+
+    the second form measures gunicorn's multiprocess mode, where flushed
+    counts are written to memory mapped files.
+'''
+import os
+import sys
+import time
+
+from flask import Flask
+from werkzeug.test import EnvironBuilder
+
+import metrics
+import queries
+
+
+def instrumented_request(response, statements):
+    queries.start_request()
+    metrics.start_request()
+    start = time.perf_counter()
+    metrics.add('auth', time.perf_counter() - start)
+    for _ in range(statements):
+        queries.before_cursor_execute(None, None, 'SELECT 1', (), None, False)
+        queries.after_cursor_execute(None, None, 'SELECT 1', (), None, False)
+    start = time.perf_counter()
+    metrics.add('serialize', time.perf_counter() - start)
+    metrics.record_request(response)
+
+
+def best_of(fn, count, repeat=5):
+    fn()
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for _ in range(count):
+            fn()
+        elapsed = time.perf_counter() - start
+        best = elapsed if best is None else min(best, elapsed)
+    return best / count * 1e6
+
+
+def main(count, statements):
+    app = Flask(__name__)
+    app.add_url_rule('/movies/<int:id>', 'movie', lambda id: '')
+    response = app.response_class(b'{}')
+    with app.test_request_context('/movies/1'):
+        overhead = best_of(
+            lambda: instrumented_request(response, statements), count)
+
+    environ = EnvironBuilder('/movies/1').get_environ()
+    bare = best_of(lambda: app(dict(environ), lambda *args: None),
+                   count // 10)
+
+    mode = ('multiprocess' if 'prometheus_multiproc_dir' in os.environ
+            else 'single process')
+    print(f'mode:             {mode}')
+    print(f'requests:         {count} x {statements} statements '
+          '(best of 5)')
+    print(f'overhead:         {overhead:.2f} us/request')
+    print(f'no-op request:    {bare:.2f} us/request')
+    print(f'relative:         {overhead / bare:.1%}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 100000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 2)
@@ -0,0 +1,217 @@
+'''
+Hot path microbenchmarks
+    times each component a request goes through on its own, in process
+    and without a network:
+
+        get_token_auth_header    reading the bearer token of a request
+        verify_decode_jwt        RS256 verification with a local key
+        decode_token (cached)    the token cache hit every later request takes
+        check_permissions        one permission against a cached payload
+        Movie.format / Actor.format
+                                 formatting ROWS loaded instances
+        jsonify                  encoding a list of ROWS formatted movies
+        Movie.query.get          a primary key read from in-memory SQLite
+
+    Every component is run in batches sized to take at least --min-time
+    seconds, --repeat times, and reported as the median, spread and
+    fastest time per call.
+
+    python -m benchmarks.micro --save        # store the baseline
+    python -m benchmarks.micro               # compare against it
+
+    the second form exits with status 1 when a component's median and
+    fastest time are both more than --threshold (default 15%) slower than
+    its baseline. Baselines are machine specific: store them on the
+    machine that compares against them.
+'''
+import argparse
+import datetime
+import json
+import os
+import platform
+import statistics
+import sys
+import time
+from itertools import cycle
+
+import rsa
+from flask import Flask
+
+import auth
+import serializer
+from benchmarks.jwks_server import JWKSServer
+from benchmarks.tokens import mint
+from models import setup_db, db, Movie, Actor
+
+ROWS = 10000
+BASELINE = os.path.join(os.path.dirname(os.path.dirname(
+    os.path.abspath(__file__))), '.benchmarks', 'micro.json')
+
+
+def components(token):
+    '''
+    the benchmarked callables, by name, run inside a request carrying
+    `token`
+    '''
+    payload = auth.decode_token(token)
+
+    Movie.insert_many([{
+        'title': f'movie {i}',
+        'release_date': datetime.datetime(1950 + i % 70, 1, 1),
+    } for i in range(ROWS)])
+    Actor.insert_many([{
+        'name': f'actor {i}', 'age': str(18 + i % 60),
+        'gender': ('female', 'male')[i % 2],
+    } for i in range(ROWS)])
+    movies = Movie.query.all()
+    actors = Actor.query.all()
+    formatted = {'success': True,
+                 'movies': [movie.format() for movie in movies]}
+    # the loaded instances stay formattable, and Movie.query.get cannot
+    # answer from the identity map
+    db.session.expunge_all()
+    ids = cycle([movie.id for movie in movies])
+
+    def get_movie():
+        db.session.expunge(Movie.query.get(next(ids)))
+
+    return {
+        'get_token_auth_header': auth.get_token_auth_header,
+        'verify_decode_jwt': lambda: auth.verify_decode_jwt(token),
+        'decode_token (cached)': lambda: auth.decode_token(token),
+        'check_permissions': lambda: auth.check_permissions(
+            'patch:movies', payload),
+        'Movie.format': lambda: [movie.format() for movie in movies],
+        'Actor.format': lambda: [actor.format() for actor in actors],
+        'jsonify': lambda: serializer.jsonify(formatted),
+        'Movie.query.get': get_movie,
+    }
+
+
+def measure(fn, repeat, min_time):
+    '''
+    seconds per call of `fn` for each of `repeat` batches
+    '''
+    fn()
+    loops = 1
+    while True:
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        elapsed = time.perf_counter() - start
+        if elapsed >= min_time:
+            break
+        loops *= 10 if elapsed < min_time / 10 else 2
+
+    times = [elapsed / loops]
+    for _ in range(repeat - 1):
+        start = time.perf_counter()
+        for _ in range(loops):
+            fn()
+        times.append((time.perf_counter() - start) / loops)
+    return {
+        'loops': loops,
+        'median': statistics.median(times),
+        'min': min(times),
+        'stdev': statistics.stdev(times) if len(times) > 1 else 0.0,
+    }
+
+
+def regressions(results, baseline, threshold):
+    '''
+    (name, change) for every component whose median and fastest time both
+    grew by more than `threshold` over the baseline; a noisy neighbour
+    slows some batches down, a regression slows all of them
+    '''
+    slower = []
+    for name, result in results.items():
+        stored = baseline.get(name)
+        if stored is None:
+            continue
+        change = result['median'] / stored['median'] - 1
+        if (change > threshold and
+                result['min'] / stored['min'] - 1 > threshold):
+            slower.append((name, change))
+    return slower
+
+
+def human(seconds):
+    for unit, scale in (('s', 1), ('ms', 1e-3), ('us', 1e-6)):
+        if seconds >= scale:
+            return f'{seconds / scale:.2f} {unit}'
+    return f'{seconds / 1e-9:.0f} ns'
+
+
+def machine():
+    return {'python': platform.python_version(),
+            'platform': platform.platform(),
+            'processor': platform.processor() or platform.machine()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='hot path microbenchmarks')
+    parser.add_argument('--repeat', type=int, default=7)
+    parser.add_argument('--min-time', type=float, default=0.2)
+    parser.add_argument('--threshold', type=float, default=0.15)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    parser.add_argument('-k', dest='only',
+                        help='only run components containing this text')
+    args = parser.parse_args()
+
+    # tokens are minted for and verified against this issuer
+    os.environ.setdefault('AUTH0_DOMAIN', 'benchmark.local')
+    key = rsa.newkeys(2048)[1]
+    jwks_server = JWKSServer(key)
+    jwks_server.start()
+    auth.AUTH0_JWKS_URL = jwks_server.url
+
+    app = Flask(__name__)
+    setup_db(app, 'sqlite://')
+    db.create_all()
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as stored:
+            stored = json.load(stored)
+        if stored['machine'] != machine():
+            print(f'warning: {args.baseline} was stored on another machine')
+        baseline = stored['results']
+
+    results = {}
+    token = mint(key, 'producer', domain=auth.auth0_domain())
+    with app.test_request_context(
+            headers={'Authorization': f'Bearer {token}'}):
+        for name, fn in components(token).items():
+            if args.only and args.only not in name:
+                continue
+            result = results[name] = measure(fn, args.repeat, args.min_time)
+            line = (f'{name:<24} {human(result["median"]):>10} '
+                    f'+- {result["stdev"] / result["median"]:>5.1%}  '
+                    f'min {human(result["min"]):>10}  '
+                    f'x{result["loops"]:<7}')
+            if name in baseline:
+                change = result['median'] / baseline[name]['median'] - 1
+                line += f' {change:>+7.1%} vs baseline'
+            print(line)
+    jwks_server.shutdown()
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as stored:
+            json.dump({'machine': machine(), 'results': results}, stored,
+                      indent=2, sort_keys=True)
+            stored.write('\n')
+        print(f'baseline stored in {args.baseline}')
+        return
+
+    slower = regressions(results, baseline, args.threshold)
+    for name, change in slower:
+        print(f'REGRESSION {name}: {change:+.1%} '
+              f'(threshold {args.threshold:.0%})')
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
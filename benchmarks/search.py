@@ -0,0 +1,82 @@
+'''
+Search latency benchmark
+    seeds the movies table up to N rows (default 1,000,000) with generated
+    titles, then times search() for a mix of exact, multi-word and
+    misspelled queries and reports p50/p95/p99 per query.
+
+    python -m benchmarks.search [rows] [repeats]
+
+    needs DATABASE_URL to point at a PostgreSQL database that has been
+    migrated (python manage.py db upgrade); seeded rows are kept so
+    later runs skip the seeding step.
+'''
+import statistics
+import sys
+import time
+
+from flask import Flask
+
+from models import setup_db, db, Movie
+from search import search
+
+WORDS = ['star', 'night', 'river', 'ghost', 'summer', 'city', 'dragon',
+         'winter', 'shadow', 'garden', 'machine', 'ocean', 'silver',
+         'empire', 'forest', 'storm', 'heart', 'island', 'mirror', 'road']
+
+QUERIES = ['dragon', 'silver ocean', 'shadw', 'empire storm road',
+           'gardn of', 'zzzz']
+
+
+def seed(rows):
+    existing = Movie.query.count()
+    if existing >= rows:
+        return existing
+    words = ','.join(f"'{word}'" for word in WORDS)
+    db.session.execute(f'''
+        INSERT INTO movies (title, release_date)
+        SELECT (ARRAY[{words}])[1 + i % 20] || ' ' ||
+               (ARRAY[{words}])[1 + (i / 20) % 20] || ' ' ||
+               (ARRAY[{words}])[1 + (i / 400) % 20] || ' ' || i,
+               timestamp '1950-01-01' + (i % 27000) * interval '1 day'
+        FROM generate_series(:start, :stop) AS i
+    ''', {'start': existing + 1, 'stop': rows})
+    db.session.commit()
+    db.session.execute('ANALYZE movies')
+    db.session.commit()
+    return rows
+
+
+def percentile(samples, fraction):
+    samples = sorted(samples)
+    return samples[min(len(samples) - 1, int(len(samples) * fraction))]
+
+
+def main(rows, repeats):
+    app = Flask(__name__)
+    setup_db(app)
+    with app.app_context():
+        db.create_all()
+        if db.engine.dialect.name != 'postgresql':
+            sys.exit('the search benchmark needs a PostgreSQL DATABASE_URL')
+
+        start = time.perf_counter()
+        total = seed(rows)
+        print(f'movies: {total:,} rows '
+              f'(seeded in {time.perf_counter() - start:.1f}s)')
+
+        print(f'{"query":<20} {"p50 ms":>8} {"p95 ms":>8} {"p99 ms":>8}')
+        for q in QUERIES:
+            samples = []
+            for _ in range(repeats):
+                start = time.perf_counter()
+                search(Movie, q, 50, 0)
+                samples.append((time.perf_counter() - start) * 1000)
+            db.session.rollback()
+            print(f'{q:<20} {statistics.median(samples):>8.2f} '
+                  f'{percentile(samples, 0.95):>8.2f} '
+                  f'{percentile(samples, 0.99):>8.2f}')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 1000000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 50)
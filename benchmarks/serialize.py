@@ -0,0 +1,110 @@
+'''
+Serialization benchmark
+    compares building a GET /movies body for N movies the old way (ORM
+    instances, Movie.format() and flask.jsonify) with the current one
+    (format() columns read as row tuples and encoded by serializer.jsonify)
+    for each available JSON backend, end to end and for the encoding step
+    alone. All bodies are checked to be identical.
+
+    python -m benchmarks.serialize [rows] [repeat]
+
+    runs against DATABASE_URL and deletes the rows it created afterwards.
+'''
+import datetime
+import sys
+import time
+
+from flask import Flask, jsonify as flask_jsonify
+
+import serializer
+from models import setup_db, db, Movie
+from projection import shaped
+
+
+def before(ids):
+    movies = Movie.query.filter(Movie.id.in_(ids)).order_by(Movie.id)
+    return flask_jsonify({
+        'success': True,
+        'movies': [movie.format() for movie in movies],
+    }).get_data()
+
+
+def after(backend):
+    def build(ids):
+        serializer.dumps = serializer.BACKENDS[backend]
+        query, format_row = shaped(Movie, None, None)
+        rows = query.filter(Movie.id.in_(ids)).order_by(Movie.id)
+        return serializer.jsonify({
+            'success': True,
+            'movies': [format_row(row) for row in rows],
+        }).get_data()
+    return build
+
+
+def encoder(backend):
+    def encode(data):
+        if backend is None:
+            return flask_jsonify(data).get_data()
+        serializer.dumps = serializer.BACKENDS[backend]
+        return serializer.jsonify(data).get_data()
+    return encode
+
+
+def rate(fn, ids, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        body = fn(ids)
+        elapsed = time.perf_counter() - start
+        db.session.expunge_all()
+        best = elapsed if best is None else min(best, elapsed)
+    return len(ids) / best, body
+
+
+def main(count, repeat):
+    app = Flask(__name__)
+    setup_db(app)
+    default = serializer.dumps
+    with app.app_context():
+        db.create_all()
+        rows = [{'title': f'bench {i}',
+                 'release_date': datetime.datetime(1950 + i % 70, 1, 1)}
+                for i in range(count)]
+        ids = [movie['id'] for movie in Movie.insert_many(rows)]
+        try:
+            baseline, expected = rate(before, ids, repeat)
+            results = [('before', baseline)]
+            for backend in serializer.BACKENDS:
+                rows_per_second, body = rate(after(backend), ids, repeat)
+                assert body == expected, f'{backend} output differs'
+                results.append((f'after ({backend})', rows_per_second))
+
+            data = {'success': True, 'movies': [
+                movie.format() for movie in Movie.query.filter(
+                    Movie.id.in_(ids)).order_by(Movie.id)]}
+            encoding = []
+            for backend in (None,) + tuple(serializer.BACKENDS):
+                rows_per_second, body = rate(
+                    lambda ids: encoder(backend)(data), ids, repeat)
+                assert body == expected, f'{backend} output differs'
+                encoding.append((backend or 'flask.jsonify',
+                                 rows_per_second))
+        finally:
+            serializer.dumps = default
+            Movie.query.filter(Movie.id.in_(ids)).delete(
+                synchronize_session=False)
+            db.session.commit()
+
+    print(f'rows:            {count} (best of {repeat})')
+    for name, rows_per_second in results:
+        print(f'{name + ":":<16} {rows_per_second:>10,.0f} rows/s  '
+              f'{rows_per_second / baseline:.1f}x')
+    print('encoding only:')
+    for name, rows_per_second in encoding:
+        print(f'{name + ":":<16} {rows_per_second:>10,.0f} rows/s  '
+              f'{rows_per_second / encoding[0][1]:.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
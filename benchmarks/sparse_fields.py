@@ -0,0 +1,76 @@
+'''
+Sparse fieldset benchmark
+    compares reading and formatting N movies as full ORM instances
+    (Movie.query + Movie.format, as GET /movies does) with reading only
+    the requested columns as row tuples (as GET /movies?fields=... does).
+
+    python -m benchmarks.sparse_fields [rows] [repeat]
+
+    runs against DATABASE_URL and deletes the rows it created afterwards.
+'''
+import datetime
+import sys
+import time
+
+from flask import Flask
+
+from models import setup_db, db, Movie
+from projection import project, row_format
+
+PROJECTIONS = (['id', 'title'], ['title'])
+
+
+def full(ids):
+    return [movie.format() for movie in
+            Movie.query.filter(Movie.id.in_(ids)).order_by(Movie.id)]
+
+
+def sparse(fields):
+    format_row = row_format(fields)
+
+    def read(ids):
+        query = project(Movie, fields).filter(Movie.id.in_(ids))
+        return [format_row(row) for row in query.order_by(Movie.id)]
+    return read
+
+
+def rate(fn, ids, repeat):
+    best = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn(ids)
+        elapsed = time.perf_counter() - start
+        db.session.expunge_all()
+        best = elapsed if best is None else min(best, elapsed)
+    return len(ids) / best
+
+
+def main(count, repeat):
+    app = Flask(__name__)
+    setup_db(app)
+    with app.app_context():
+        db.create_all()
+        rows = [{'title': f'bench {i}',
+                 'release_date': datetime.datetime(2020, 1, 1)}
+                for i in range(count)]
+        ids = [movie['id'] for movie in Movie.insert_many(rows)]
+        try:
+            results = [('all fields', rate(full, ids, repeat))]
+            for fields in PROJECTIONS:
+                results.append((','.join(fields),
+                                rate(sparse(fields), ids, repeat)))
+        finally:
+            Movie.query.filter(Movie.id.in_(ids)).delete(
+                synchronize_session=False)
+            db.session.commit()
+
+    baseline = results[0][1]
+    print(f'rows:        {count} (best of {repeat})')
+    for name, rows_per_second in results:
+        print(f'{name + ":":<12} {rows_per_second:>10,.0f} rows/s  '
+              f'{rows_per_second / baseline:.1f}x')
+
+
+if __name__ == '__main__':
+    main(int(sys.argv[1]) if len(sys.argv) > 1 else 10000,
+         int(sys.argv[2]) if len(sys.argv) > 2 else 5)
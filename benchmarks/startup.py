@@ -0,0 +1,137 @@
+'''
+Startup benchmark
+    times what a new process pays before it has served its first request,
+    each phase in a fresh interpreter, --repeat times:
+
+        import          `import app`, which should read no configuration
+                        and do no I/O
+        create_app      the first access to app.app
+        first request   a GET /movies with a minted token on the new app:
+                        warm-up, the key set from a local JWKS server,
+                        the first connection and the first query
+
+    and reports the median and fastest time of each. Like
+    benchmarks.micro it stores a per machine baseline with --save and
+    otherwise exits with status 1 when a phase's median and fastest time
+    are both more than --threshold slower than the baseline.
+
+    python -m benchmarks.startup --save     # store the baseline
+    python -m benchmarks.startup            # compare against it
+'''
+import argparse
+import datetime
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+import rsa
+from flask import Flask
+
+from benchmarks.jwks_server import JWKSServer
+from benchmarks.micro import human, machine, regressions
+from benchmarks.tokens import mint
+from models import setup_db, db, Movie
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+BASELINE = os.path.join(ROOT, '.benchmarks', 'startup.json')
+PHASES = ('import', 'create_app', 'first request')
+
+# run in a fresh interpreter; prints the seconds each phase took
+CHILD = '''
+import json, sys, time
+start = time.perf_counter()
+import app
+imported = time.perf_counter()
+flask_app = app.app
+created = time.perf_counter()
+response = flask_app.test_client().get(
+    '/movies', headers={'Authorization': 'Bearer ' + sys.argv[1]})
+served = time.perf_counter()
+assert response.status_code == 200, response.status_code
+print(json.dumps([imported - start, created - imported, served - created]))
+'''
+
+
+def schema(database_path):
+    app = Flask(__name__)
+    setup_db(app, database_path)
+    with app.app_context():
+        db.create_all()
+        Movie.insert_many([{'title': 'startup',
+                            'release_date': datetime.datetime(2020, 1, 1)}])
+
+
+def run(repeat):
+    key = rsa.newkeys(2048)[1]
+    jwks_server = JWKSServer(key)
+    jwks_server.start()
+    domain = os.environ.get('AUTH0_DOMAIN', 'benchmark.local')
+    token = mint(key, 'assistant', domain=domain)
+    times = {phase: [] for phase in PHASES}
+    with tempfile.TemporaryDirectory() as directory:
+        database_path = f'sqlite:///{directory}/startup.db'
+        schema(database_path)
+        env = dict(os.environ, DATABASE_URL=database_path,
+                   AUTH0_DOMAIN=domain, AUTH0_JWKS_URL=jwks_server.url)
+        for _ in range(repeat):
+            output = subprocess.run(
+                [sys.executable, '-c', CHILD, token], cwd=ROOT, env=env,
+                check=True, capture_output=True, text=True).stdout
+            for phase, seconds in zip(PHASES, json.loads(output)):
+                times[phase].append(seconds)
+    jwks_server.shutdown()
+    return {phase: {'median': statistics.median(values),
+                    'min': min(values),
+                    'stdev': statistics.stdev(values) if repeat > 1 else 0.0}
+            for phase, values in times.items()}
+
+
+def main():
+    parser = argparse.ArgumentParser(description='startup time benchmark')
+    parser.add_argument('--repeat', type=int, default=10)
+    parser.add_argument('--threshold', type=float, default=0.15)
+    parser.add_argument('--baseline', default=BASELINE)
+    parser.add_argument('--save', action='store_true',
+                        help='store the results as the new baseline')
+    args = parser.parse_args()
+
+    baseline = {}
+    if not args.save and os.path.exists(args.baseline):
+        with open(args.baseline) as stored:
+            stored = json.load(stored)
+        if stored['machine'] != machine():
+            print(f'warning: {args.baseline} was stored on another machine')
+        baseline = stored['results']
+
+    results = run(args.repeat)
+    for phase, result in results.items():
+        line = (f'{phase:<14} {human(result["median"]):>10} '
+                f'+- {result["stdev"] / result["median"]:>5.1%}  '
+                f'min {human(result["min"]):>10}')
+        if phase in baseline:
+            change = result['median'] / baseline[phase]['median'] - 1
+            line += f' {change:>+7.1%} vs baseline'
+        print(line)
+
+    if args.save:
+        os.makedirs(os.path.dirname(args.baseline) or '.', exist_ok=True)
+        with open(args.baseline, 'w') as stored:
+            json.dump({'machine': machine(), 'results': results}, stored,
+                      indent=2, sort_keys=True)
+            stored.write('\n')
+        print(f'baseline stored in {args.baseline}')
+        return
+
+    slower = regressions(results, baseline, args.threshold)
+    for phase, change in slower:
+        print(f'REGRESSION {phase}: {change:+.1%} '
+              f'(threshold {args.threshold:.0%})')
+    if slower:
+        sys.exit(1)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,96 @@
+'''
+Token minter
+    signs RS256 tokens for the three roles with a local key, in the shape
+    Auth0 issues them (issuer https://AUTH0_DOMAIN/, audience `image`, a
+    `permissions` claim), so the API can be driven without Auth0. The API
+    has to trust the key: serve it with benchmarks.jwks_server and point
+    AUTH0_JWKS_URL at it.
+
+    python -m benchmarks.tokens --key bench-key.pem [role ...]
+
+    prints `role token` lines; the key file is created if it is missing.
+'''
+import argparse
+import base64
+import hashlib
+import os
+import time
+
+import rsa
+from jose import jwt
+
+ROLES = {
+    'assistant': ['get:actors', 'get:movies'],
+    'director': ['delete:actors', 'get:actors', 'get:movies',
+                 'patch:actors', 'patch:movies', 'post:actors'],
+    'producer': ['delete:actors', 'delete:movies', 'get:actors',
+                 'get:movies', 'patch:actors', 'patch:movies',
+                 'post:actors', 'post:movies'],
+}
+AUDIENCE = 'image'
+
+
+def load_key(path, bits=2048):
+    '''
+    the RSA private key in `path`, generated and saved there if missing
+    '''
+    if os.path.exists(path):
+        with open(path, 'rb') as key_file:
+            return rsa.PrivateKey.load_pkcs1(key_file.read())
+    _, key = rsa.newkeys(bits)
+    with open(path, 'wb') as key_file:
+        key_file.write(key.save_pkcs1())
+    return key
+
+
+def b64(number):
+    data = number.to_bytes((number.bit_length() + 7) // 8, 'big')
+    return base64.urlsafe_b64encode(data).rstrip(b'=').decode()
+
+
+def key_id(key):
+    return hashlib.sha256(b64(key.n).encode()).hexdigest()[:16]
+
+
+def jwks(key):
+    '''
+    the JSON Web Key Set publishing the public half of `key`
+    '''
+    return {'keys': [{
+        'kty': 'RSA',
+        'kid': key_id(key),
+        'use': 'sig',
+        'alg': 'RS256',
+        'n': b64(key.n),
+        'e': b64(key.e),
+    }]}
+
+
+def mint(key, role, ttl=3600, domain=None, permissions=None):
+    domain = domain or os.environ['AUTH0_DOMAIN']
+    now = int(time.time())
+    return jwt.encode({
+        'iss': f'https://{domain}/',
+        'sub': f'benchmark|{role}',
+        'aud': AUDIENCE,
+        'iat': now,
+        'exp': now + ttl,
+        'permissions': ROLES[role] if permissions is None else permissions,
+    }, key.save_pkcs1().decode(), algorithm='RS256',
+        headers={'kid': key_id(key)})
+
+
+def main():
+    parser = argparse.ArgumentParser(description='mint benchmark tokens')
+    parser.add_argument('--key', default='bench-key.pem')
+    parser.add_argument('--ttl', type=int, default=3600)
+    parser.add_argument('roles', nargs='*', default=list(ROLES),
+                        choices=list(ROLES))
+    args = parser.parse_args()
+    key = load_key(args.key)
+    for role in args.roles:
+        print(role, mint(key, role, args.ttl))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,377 @@
+import hashlib
+import logging
+import os
+import shutil
+import threading
+import time
+import zlib
+from collections import OrderedDict
+from functools import wraps
+from flask import request, abort, make_response, current_app
+from models import table_version, row_version
+
+try:
+    import redis
+except ImportError:
+    redis = None
+
+logger = logging.getLogger(__name__)
+
+'''
+LRUCache
+    in-process tier of the response cache. Entries are bounded by count and
+    by total body bytes, expire after `ttl` seconds, and are indexed by tag
+    so a write can drop exactly the entries it made stale.
+'''
+
+
+class LRUCache:
+    def __init__(self, max_entries, max_bytes, ttl):
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.ttl = ttl
+        self.size = 0
+        self.counters = {'hits': 0, 'misses': 0, 'evictions': 0}
+        self._entries = OrderedDict()
+        self._tags = {}
+        self._lock = threading.Lock()
+
+    def get(self, tag, key):
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None or entry[0] <= time.monotonic():
+                if entry is not None:
+                    self._remove(key)
+                self.counters['misses'] += 1
+                return None
+            self._entries.move_to_end(key)
+            self.counters['hits'] += 1
+            return entry[2]
+
+    def set(self, tag, key, value):
+        if len(value) > self.max_bytes:
+            return
+        with self._lock:
+            if key in self._entries:
+                self._remove(key)
+            self._entries[key] = (time.monotonic() + self.ttl, tag, value)
+            self._tags.setdefault(tag, set()).add(key)
+            self.size += len(value)
+            while (len(self._entries) > self.max_entries or
+                   self.size > self.max_bytes):
+                self._remove(next(iter(self._entries)))
+                self.counters['evictions'] += 1
+
+    def invalidate(self, tag):
+        with self._lock:
+            for key in list(self._tags.get(tag, ())):
+                self._remove(key)
+
+    def _remove(self, key):
+        expires, tag, value = self._entries.pop(key)
+        self.size -= len(value)
+        keys = self._tags.get(tag)
+        if keys is not None:
+            keys.discard(key)
+            if not keys:
+                del self._tags[tag]
+
+    def stats(self):
+        return dict(self.counters, entries=len(self._entries),
+                    bytes=self.size)
+
+
+'''
+FileStore
+    shared tier backed by a directory, ideally on tmpfs (/dev/shm), so every
+    gunicorn worker on the host sees the same entries. One sub directory
+    per tag makes invalidation a single rename + rmtree. Files older than
+    `ttl` are ignored, and once `max_bytes` have been written since the last
+    sweep the oldest files are pruned back under the limit.
+'''
+
+
+class FileStore:
+    def __init__(self, directory, ttl, max_bytes):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._written = 0
+
+    def _path(self, tag, key):
+        name = hashlib.sha1(key.encode()).hexdigest()
+        return os.path.join(self.directory, tag, name)
+
+    def get(self, tag, key):
+        path = self._path(tag, key)
+        try:
+            if os.stat(path).st_mtime + self.ttl <= time.time():
+                return None
+            with open(path, 'rb') as f:
+                return f.read()
+        except FileNotFoundError:
+            return None
+
+    def set(self, tag, key, value):
+        path = self._path(tag, key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        tmp = f'{path}.{os.getpid()}.{threading.get_ident()}'
+        with open(tmp, 'wb') as f:
+            f.write(value)
+        os.replace(tmp, path)
+
+        self._written += len(value)
+        if self._written > self.max_bytes:
+            self._written = 0
+            self.prune()
+
+    def invalidate(self, tag):
+        path = os.path.join(self.directory, tag)
+        doomed = f'{path}.{os.getpid()}.{threading.get_ident()}.stale'
+        try:
+            os.rename(path, doomed)
+        except FileNotFoundError:
+            return
+        shutil.rmtree(doomed, ignore_errors=True)
+
+    def prune(self):
+        files = []
+        for root, dirs, names in os.walk(self.directory):
+            for name in names:
+                path = os.path.join(root, name)
+                try:
+                    stat = os.stat(path)
+                except FileNotFoundError:
+                    continue
+                files.append((stat.st_mtime, stat.st_size, path))
+
+        total = sum(size for mtime, size, path in files)
+        now = time.time()
+        for mtime, size, path in sorted(files):
+            if total <= self.max_bytes and mtime + self.ttl > now:
+                break
+            try:
+                os.remove(path)
+            except FileNotFoundError:
+                pass
+            total -= size
+
+
+'''
+RedisStore
+    shared tier on a Redis protocol server (Redis, KeyDB, or any local
+    stand-in speaking the protocol). Each tag keeps a set of its keys so
+    it can be invalidated precisely; size based eviction is left to the
+    server's maxmemory policy.
+'''
+
+
+class RedisStore:
+    def __init__(self, url, ttl):
+        if redis is None:
+            raise RuntimeError(
+                'RESPONSE_CACHE_URL is a redis:// url but the redis '
+                'package is not installed')
+        self.client = redis.Redis.from_url(url)
+        self.ttl = int(ttl)
+
+    def get(self, tag, key):
+        return self.client.get(key)
+
+    def set(self, tag, key, value):
+        pipe = self.client.pipeline()
+        pipe.set(key, value, ex=self.ttl)
+        pipe.sadd(f'tag:{tag}', key)
+        pipe.expire(f'tag:{tag}', self.ttl)
+        pipe.execute()
+
+    def invalidate(self, tag):
+        keys = self.client.smembers(f'tag:{tag}')
+        self.client.delete(f'tag:{tag}', *keys)
+
+
+'''
+ResponseCache
+    two tier cache of rendered GET response bodies. Lookups try the
+    in-process LRU first, then the optional shared tier (promoting hits
+    into the LRU). A failing shared tier is logged and treated as a miss;
+    it never fails the request.
+'''
+
+
+class ResponseCache:
+    def __init__(self, local, shared=None):
+        self.local = local
+        self.shared = shared
+        self.counters = {'shared_hits': 0, 'shared_misses': 0,
+                         'shared_errors': 0}
+
+    @classmethod
+    def from_env(cls):
+        entries = int(os.environ.get('RESPONSE_CACHE_SIZE', 1024))
+        max_bytes = int(os.environ.get('RESPONSE_CACHE_MAX_BYTES',
+                                       64 * 1024 * 1024))
+        ttl = float(os.environ.get('RESPONSE_CACHE_TTL', 300))
+        url = os.environ.get('RESPONSE_CACHE_URL', '')
+
+        if entries <= 0:
+            return None
+        shared = None
+        if url.startswith('redis://') or url.startswith('rediss://'):
+            shared = RedisStore(url, ttl)
+        elif url.startswith('file://'):
+            shared = FileStore(url[len('file://'):], ttl, max_bytes)
+        return cls(LRUCache(entries, max_bytes, ttl), shared)
+
+    def get(self, tag, key):
+        value = self.local.get(tag, key)
+        if value is not None or self.shared is None:
+            return value
+        value = self._shared('get', tag, key)
+        if value is None:
+            self.counters['shared_misses'] += 1
+            return None
+        self.counters['shared_hits'] += 1
+        self.local.set(tag, key, value)
+        return value
+
+    def set(self, tag, key, value):
+        self.local.set(tag, key, value)
+        if self.shared is not None:
+            self._shared('set', tag, key, value)
+
+    def invalidate(self, *tags):
+        for tag in tags:
+            self.local.invalidate(tag)
+            if self.shared is not None:
+                self._shared('invalidate', tag)
+
+    def _shared(self, method, *args):
+        try:
+            return getattr(self.shared, method)(*args)
+        except Exception:
+            self.counters['shared_errors'] += 1
+            logger.warning('Shared response cache %s failed', method,
+                           exc_info=True)
+            return None
+
+    def stats(self):
+        local = self.local.stats()
+        hits = local['hits'] + self.counters['shared_hits']
+        lookups = local['hits'] + local['misses']
+        return dict(
+            local,
+            **self.counters,
+            hit_rate=hits / lookups if lookups else 0.0)
+
+
+response_cache = ResponseCache.from_env()
+
+
+def cache_stats():
+    return None if response_cache is None else response_cache.stats()
+
+
+'''
+Cached GETs
+    list routes are tagged with the change version of their table and
+    detail routes with the version of their row. Both are read with one
+    single-column lookup, so a poll whose If-None-Match still matches is
+    answered with 304 Not Modified before any ORM object is loaded, and a
+    repeated read is served from the response cache. Cache keys embed the
+    version, so an entry written before a change can never be served after
+    it, even from another worker's in-process tier.
+'''
+
+
+def version_tag(model, id=None):
+    '''
+    returns the current version tag for a list (id None) or a single row,
+    or None when the row does not exist
+    '''
+    if id is None:
+        version = table_version(model.__tablename__)
+        return f'{model.__tablename__}-{version}'
+    version = row_version(model, id)
+    if version is None:
+        return None
+    return f'{model.__tablename__}-{id}-{version}'
+
+
+def cache_tag(model, id=None):
+    if id is None:
+        return model.__tablename__
+    return f'{model.__tablename__}-{id}'
+
+
+def cached_get(model, *related, related_for=None):
+    '''
+    cached_get(model, *related, related_for=None)
+        caches a GET route of `model` (a list, or a row when the route has
+        an `id`) and answers If-None-Match; responses that also show rows
+        of the `related` models, or of the models `related_for()` returns
+        for the current request, are keyed on their table versions as well
+    '''
+    def cached_get_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            id = kwargs.get('id')
+            tag = version_tag(model, id)
+            if tag is None:
+                abort(404)
+            others = list(related)
+            if related_for is not None:
+                others += related_for()
+            for other in others:
+                tag = f'{tag}-{version_tag(other)}'
+
+            # the same version renders differently per query string and format
+            accept = request.headers.get('Accept', '')
+            variant = request.query_string + accept.encode()
+            etag = f'{tag}-{zlib.crc32(variant):08x}'
+            if request.if_none_match.contains(etag):
+                response = make_response('', 304)
+                response.set_etag(etag)
+                return response
+
+            key = f'{tag}:{request.full_path}:{accept}'
+            body = None
+            if response_cache is not None:
+                body = response_cache.get(cache_tag(model, id), key)
+            if body is not None:
+                response = current_app.response_class(
+                    body, mimetype='application/json')
+            else:
+                response = make_response(f(*args, **kwargs))
+                if (response_cache is not None and
+                        response.status_code == 200 and
+                        not response.is_streamed):
+                    response_cache.set(cache_tag(model, id), key,
+                                       response.get_data())
+
+            if response.status_code == 200:
+                response.set_etag(etag)
+            return response
+
+        return wrapper
+    return cached_get_decorator
+
+
+def invalidates(model):
+    '''
+    drops the cached list pages of `model`, and the cached detail of the
+    row named by the route's `id`, once a write route has succeeded
+    '''
+    def invalidates_decorator(f):
+        @wraps(f)
+        def wrapper(*args, **kwargs):
+            response = make_response(f(*args, **kwargs))
+            if response_cache is not None and response.status_code < 400:
+                tags = [cache_tag(model)]
+                if 'id' in kwargs:
+                    tags.append(cache_tag(model, kwargs['id']))
+                response_cache.invalidate(*tags)
+            return response
+
+        return wrapper
+    return invalidates_decorator
@@ -0,0 +1,130 @@
+import datetime
+from flask import abort
+from sqlalchemy import Integer, func, tuple_
+from models import Movie, Actor
+
+'''
+Filtering and sorting
+    query parameters for the list routes. Every filter and sort order
+    below is backed by one of the B-tree indexes declared on the models
+    (see migrations/versions/5ba7c5bde5e9_add_filter_indexes.py), and each
+    sort order ends in the primary key so keyset cursors stay unique.
+
+    actors.age is stored as a string, so it is compared and sorted as
+    (length(age), age): for digit strings that is numeric order, and
+    unlike a cast it cannot fail on a malformed value.
+'''
+
+AGE_KEY = [func.length(Actor.age, type_=Integer), Actor.age]
+
+MOVIE_SORTS = {
+    'id': [Movie.id],
+    'title': [Movie.title, Movie.id],
+    'release_date': [Movie.release_date, Movie.id],
+}
+
+ACTOR_SORTS = {
+    'id': [Actor.id],
+    'name': [Actor.name, Actor.id],
+    'gender': [Actor.gender, Actor.id],
+    'age': AGE_KEY + [Actor.id],
+}
+
+
+def sort_keys(sorts, value):
+    '''
+    sort_keys(sorts, value)
+        maps `?sort=` (a key of `sorts`, optionally prefixed with '-' for
+        descending order) to its ORDER BY expressions and direction
+    '''
+    value = value or 'id'
+    descending = value.startswith('-')
+    keys = sorts.get(value.lstrip('-'))
+    if keys is None:
+        abort(400)
+    return keys, descending
+
+
+def parse_date(value):
+    try:
+        return datetime.datetime.fromisoformat(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def parse_age(value):
+    value = str(value)
+    if not value.isdigit():
+        abort(400)
+    value = value.lstrip('0') or '0'
+    return tuple_(len(value), value)
+
+
+def movie_filters(params):
+    '''
+    builds the WHERE criteria for `release_after`, `release_before`
+    (both inclusive) and `title_prefix`
+    '''
+    criteria = []
+    if params.get('release_after') is not None:
+        criteria.append(
+            Movie.release_date >= parse_date(params['release_after']))
+    if params.get('release_before') is not None:
+        criteria.append(
+            Movie.release_date <= parse_date(params['release_before']))
+    if params.get('title_prefix') is not None:
+        criteria.append(
+            Movie.title.startswith(params['title_prefix'], autoescape=True))
+    return criteria
+
+
+def actor_filters(params):
+    '''
+    builds the WHERE criteria for `gender`, `name_prefix`, `min_age`
+    and `max_age` (both inclusive)
+    '''
+    criteria = []
+    if params.get('gender') is not None:
+        criteria.append(Actor.gender == params['gender'])
+    if params.get('name_prefix') is not None:
+        criteria.append(
+            Actor.name.startswith(params['name_prefix'], autoescape=True))
+    if params.get('min_age') is not None:
+        criteria.append(tuple_(*AGE_KEY) >= parse_age(params['min_age']))
+    if params.get('max_age') is not None:
+        criteria.append(tuple_(*AGE_KEY) <= parse_age(params['max_age']))
+    return criteria
+
+
+BULK_FILTERS = {
+    Movie: (movie_filters, {
+        'release_after': str, 'release_before': str, 'title_prefix': str}),
+    Actor: (actor_filters, {
+        'gender': str, 'name_prefix': str, 'min_age': int, 'max_age': int}),
+}
+
+
+def bulk_criteria(model, params):
+    '''
+    builds the WHERE criteria of a bulk update or delete of `model` from
+    its `filter` object: `ids`, a list of ids, and the filters of the
+    model's list route. An unknown key, a value of the wrong JSON type or
+    an empty filter is a 400, so a typo cannot widen a write to the whole
+    table.
+    '''
+    filters, types = BULK_FILTERS[model]
+    if not isinstance(params, dict) or not params:
+        abort(400)
+    for name, value in params.items():
+        if name == 'ids':
+            if (not isinstance(value, list) or not value or
+                    not all(type(id) is int for id in value)):
+                abort(400)
+        # bool is an int to isinstance, but never a valid filter
+        elif name not in types or type(value) is not types[name]:
+            abort(400)
+
+    criteria = filters(params)
+    if 'ids' in params:
+        criteria.append(model.id.in_(params['ids']))
+    return criteria
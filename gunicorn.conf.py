@@ -0,0 +1,60 @@
+import glob
+import os
+
+'''
+gunicorn settings, loaded automatically by `gunicorn app:app`
+
+The app is imported once in the arbiter and forked into the workers
+(preload_app), so they share its memory and a broken deploy fails before
+any worker starts. Each worker runs `threads` requests at a time
+(gthread): requests mostly wait on PostgreSQL and Auth0, and threads let
+304s, cache hits and auth rejections through while slower requests wait
+for the database or are shed by admission control. gevent is not used:
+psycopg2 would block its event loop.
+
+    WEB_CONCURRENCY     worker processes (default 2 per CPU)
+    GUNICORN_THREADS    threads per worker (default 16, above the
+                        admission limits so there are threads left for
+                        cheap requests)
+
+Size PostgreSQL max_connections for WEB_CONCURRENCY times the pool size
+plus overflow. Each worker warms up (warmup.py) before it accepts
+connections: the first requests after a deploy find the signing keys
+fetched and the connection pool open.
+
+With prometheus_multiproc_dir set, each worker writes its metrics to
+files in that directory and /metrics aggregates them. The files of a
+previous run are removed when the arbiter starts.
+'''
+
+preload_app = True
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2 * (os.cpu_count() or 1)))
+threads = int(os.environ.get('GUNICORN_THREADS', 16))
+keepalive = 5
+
+
+def on_starting(server):
+    directory = os.environ.get('prometheus_multiproc_dir')
+    if directory:
+        os.makedirs(directory, exist_ok=True)
+        for path in glob.glob(os.path.join(directory, '*.db')):
+            os.remove(path)
+
+
+def when_ready(server):
+    # connections the preloaded app opened belong to the arbiter
+    if server.cfg.preload_app:
+        import warmup
+        warmup.dispose_engines(server.app.wsgi())
+
+
+def post_worker_init(worker):
+    import warmup
+    warmup.warm_up(worker.wsgi)
+
+
+def child_exit(server, worker):
+    if os.environ.get('prometheus_multiproc_dir'):
+        from prometheus_client import multiprocess
+        multiprocess.mark_process_dead(worker.pid)
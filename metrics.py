@@ -0,0 +1,210 @@
+import logging
+import os
+import threading
+import time
+from bisect import bisect_left
+from time import perf_counter
+from flask import _request_ctx_stack
+from prometheus_client import (CONTENT_TYPE_LATEST, REGISTRY,
+                               CollectorRegistry, Counter, Histogram,
+                               generate_latest, multiprocess)
+from background import BackgroundThread
+import queries
+
+logger = logging.getLogger(__name__)
+
+'''
+Request metrics
+    every request is timed from before_request to after_request and
+    recorded in http_request_duration_seconds, labelled by method, route
+    rule and status code; its _count is the per-route request count. The
+    time spent in each phase of the request is recorded separately in
+    http_request_phase_seconds:
+
+        auth       reading the Authorization header, fetching the JWKS,
+                   verifying the token and checking its permissions
+        db         executing SQL statements, on any engine
+        serialize  encoding the JSON response body
+
+    a phase is only observed for requests that went through it, so a
+    cached response does not pull the db histogram towards zero. Bodies
+    streamed after the view returns are not timed. The statements each
+    request ran, counted by queries.py, add up in
+    http_request_queries_total.
+
+    Observing a prometheus_client histogram takes a lock per bucket and,
+    in multiprocess mode, writes to a memory mapped file, several
+    microseconds per request. Requests are instead appended to a plain
+    per-process list under one lock, and a background thread sorts them
+    into buckets and flushes them into the histograms every
+    METRICS_FLUSH_INTERVAL seconds (and before every scrape of this
+    process). Under gunicorn, set
+    prometheus_multiproc_dir to an empty directory shared by the workers
+    and /metrics aggregates every worker's samples.
+'''
+
+PHASES = ('auth', 'db', 'serialize')
+BUCKETS = (.0005, .001, .0025, .005, .01, .025, .05, .1, .25, .5,
+           1, 2.5, 5, 10)
+
+REQUEST_SECONDS = Histogram(
+    'http_request_duration_seconds', 'Time spent handling a request',
+    ('method', 'route', 'status'), buckets=BUCKETS)
+PHASE_SECONDS = Histogram(
+    'http_request_phase_seconds', 'Time spent in each phase of a request',
+    ('method', 'route', 'status', 'phase'), buckets=BUCKETS)
+REQUEST_QUERIES = Counter(
+    'http_request_queries', 'SQL statements run by requests',
+    ('method', 'route', 'status'))
+
+
+'''
+Recorder
+    the per-process list requests are recorded in before they are flushed
+    into the prometheus_client histograms
+'''
+
+
+class Recorder:
+    def __init__(self, interval=None):
+        if interval is None:
+            interval = os.environ.get('METRICS_FLUSH_INTERVAL', 1)
+        self.interval = float(interval)
+        self._pending = []
+        self._lock = threading.Lock()
+        self._thread = BackgroundThread(
+            'metrics-flush', self._flush_loop, prepare=self._drop_pending)
+
+    def record(self, labels, phases, statements=0):
+        '''
+        count a request's times, {phase: seconds} with the total under
+        None, and the number of statements it ran for `labels`
+        '''
+        with self._lock:
+            self._pending.append((labels, phases, statements))
+
+    def flush(self):
+        '''
+        move the pending requests into the histograms
+        '''
+        with self._lock:
+            pending, self._pending = self._pending, []
+        for labels, (statements, by_phase) in self.count(pending).items():
+            if statements:
+                REQUEST_QUERIES.labels(*labels).inc(statements)
+            for phase, counts in by_phase.items():
+                if phase is None:
+                    child = REQUEST_SECONDS.labels(*labels)
+                else:
+                    child = PHASE_SECONDS.labels(*labels, phase)
+                # Histogram.observe without the per-observation locking;
+                # _sum and _buckets are the values it increments
+                child._sum.inc(counts[0])
+                for bucket, count in zip(child._buckets, counts[1:]):
+                    if count:
+                        bucket.inc(count)
+
+    @staticmethod
+    def count(pending):
+        '''
+        {labels: [statements, {phase: counts}]} of recorded requests, with
+        counts [sum, count in each bucket of BUCKETS, count above them]
+        '''
+        totals = {}
+        for labels, phases, statements in pending:
+            total = totals.get(labels)
+            if total is None:
+                total = totals[labels] = [0, {}]
+            total[0] += statements
+            by_phase = total[1]
+            for phase, seconds in phases.items():
+                counts = by_phase.get(phase)
+                if counts is None:
+                    counts = by_phase[phase] = [0.0] * (len(BUCKETS) + 2)
+                counts[0] += seconds
+                counts[bisect_left(BUCKETS, seconds) + 1] += 1
+        return totals
+
+    def start(self):
+        '''
+        start the flush thread for the current process
+        '''
+        self._thread.start()
+
+    def _drop_pending(self):
+        # counts inherited from the parent are the parent's to flush
+        with self._lock:
+            self._pending = []
+
+    def _flush_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                logger.exception('Unable to flush request metrics')
+
+
+recorder = Recorder()
+_local = threading.local()
+
+
+def start_request():
+    _local.start = perf_counter()
+    _local.phases = {}
+
+
+def add(phase, seconds):
+    '''
+    add time spent in a phase to the current request, if there is one
+    '''
+    phases = getattr(_local, 'phases', None)
+    if phases is not None:
+        phases[phase] = phases.get(phase, 0.0) + seconds
+
+
+def record_request(response):
+    phases = getattr(_local, 'phases', None)
+    if phases is None:
+        return response
+    phases[None] = perf_counter() - _local.start
+    _local.phases = None
+    statements, seconds = queries.current() or (0, 0.0)
+    if statements:
+        phases['db'] = seconds
+
+    # unmatched paths and methods are client supplied; keep them out of
+    # the label values
+    current = _request_ctx_stack.top.request
+    rule = current.url_rule
+    if rule is None:
+        labels = ('', 'unmatched', str(response.status_code))
+    else:
+        labels = (current.method, rule.rule, str(response.status_code))
+    recorder.record(labels, phases, statements)
+    return response
+
+
+def init_app(app):
+    # the flush thread starts on warm-up or the first request, never in a
+    # gunicorn arbiter that preloads the app and forks its workers
+    app.before_request(recorder.start)
+    app.before_request(start_request)
+    app.after_request(record_request)
+
+
+def registry():
+    '''
+    the registry to expose: this process's metrics, or every worker's when
+    prometheus_multiproc_dir is set
+    '''
+    if 'prometheus_multiproc_dir' not in os.environ:
+        return REGISTRY
+    registry = CollectorRegistry()
+    multiprocess.MultiProcessCollector(registry)
+    return registry
+
+
+def exposition():
+    recorder.flush()
+    return generate_latest(registry()), CONTENT_TYPE_LATEST
@@ -0,0 +1,35 @@
+"""add full-text and trigram search indexes
+
+Revision ID: 22666f462a48
+Revises: 5ba7c5bde5e9
+Create Date: 2026-10-18 11:21:52.730914
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '22666f462a48'
+down_revision = '5ba7c5bde5e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute("CREATE INDEX ix_movies_title_fts ON movies "
+               "USING gin (to_tsvector('simple', title))")
+    op.execute('CREATE INDEX ix_movies_title_trgm ON movies '
+               'USING gin (title gin_trgm_ops)')
+    op.execute("CREATE INDEX ix_actors_name_fts ON actors "
+               "USING gin (to_tsvector('simple', name))")
+    op.execute('CREATE INDEX ix_actors_name_trgm ON actors '
+               'USING gin (name gin_trgm_ops)')
+
+
+def downgrade():
+    op.drop_index('ix_actors_name_trgm', table_name='actors')
+    op.drop_index('ix_actors_name_fts', table_name='actors')
+    op.drop_index('ix_movies_title_trgm', table_name='movies')
+    op.drop_index('ix_movies_title_fts', table_name='movies')
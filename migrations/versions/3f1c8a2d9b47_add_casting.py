@@ -0,0 +1,36 @@
+"""add casting association of movies and actors
+
+Revision ID: 3f1c8a2d9b47
+Revises: 22666f462a48
+Create Date: 2026-10-18 19:02:40.118733
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '3f1c8a2d9b47'
+down_revision = '22666f462a48'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'casting',
+        sa.Column('movie_id', sa.Integer(), nullable=False),
+        sa.Column('actor_id', sa.Integer(), nullable=False),
+        sa.ForeignKeyConstraint(['movie_id'], ['movies.id'],
+                                ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['actor_id'], ['actors.id'],
+                                ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('movie_id', 'actor_id')
+    )
+    op.create_index('ix_casting_actor_id', 'casting',
+                    ['actor_id', 'movie_id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_casting_actor_id', table_name='casting')
+    op.drop_table('casting')
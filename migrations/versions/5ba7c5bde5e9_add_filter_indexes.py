@@ -0,0 +1,44 @@
+"""add indexes for list filters and sort orders
+
+Revision ID: 5ba7c5bde5e9
+Revises: 762e51d8e6ce
+Create Date: 2026-10-18 10:03:11.524617
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '5ba7c5bde5e9'
+down_revision = '762e51d8e6ce'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_index('ix_movies_release_date', 'movies',
+                    ['release_date', 'id'], unique=False)
+    op.create_index('ix_movies_title', 'movies', ['title', 'id'], unique=False)
+    op.create_index('ix_movies_title_prefix', 'movies', ['title'],
+                    unique=False,
+                    postgresql_ops={'title': 'varchar_pattern_ops'})
+    op.create_index('ix_actors_name', 'actors', ['name', 'id'], unique=False)
+    op.create_index('ix_actors_name_prefix', 'actors', ['name'],
+                    unique=False,
+                    postgresql_ops={'name': 'varchar_pattern_ops'})
+    op.create_index('ix_actors_gender', 'actors', ['gender', 'id'],
+                    unique=False)
+    # actors.age is a string, ordered as (length(age), age)
+    op.create_index('ix_actors_age', 'actors',
+                    [sa.text('length(age)'), 'age', 'id'], unique=False)
+
+
+def downgrade():
+    op.drop_index('ix_actors_age', table_name='actors')
+    op.drop_index('ix_actors_gender', table_name='actors')
+    op.drop_index('ix_actors_name_prefix', table_name='actors')
+    op.drop_index('ix_actors_name', table_name='actors')
+    op.drop_index('ix_movies_title_prefix', table_name='movies')
+    op.drop_index('ix_movies_title', table_name='movies')
+    op.drop_index('ix_movies_release_date', table_name='movies')
@@ -0,0 +1,38 @@
+"""add row and table versions
+
+Revision ID: 762e51d8e6ce
+Revises: db3e06925564
+Create Date: 2026-10-18 09:12:40.118302
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '762e51d8e6ce'
+down_revision = 'db3e06925564'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.add_column('movies', sa.Column('version', sa.Integer(),
+                                      server_default='1', nullable=False))
+    op.add_column('actors', sa.Column('version', sa.Integer(),
+                                      server_default='1', nullable=False))
+    table_versions = op.create_table('table_versions',
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('version', sa.Integer(), nullable=False),
+    sa.PrimaryKeyConstraint('name')
+    )
+    op.bulk_insert(table_versions, [
+        {'name': 'movies', 'version': 0},
+        {'name': 'actors', 'version': 0},
+    ])
+
+
+def downgrade():
+    op.drop_table('table_versions')
+    op.drop_column('actors', 'version')
+    op.drop_column('movies', 'version')
@@ -0,0 +1,62 @@
+"""add catalog_stats materialized view
+
+Revision ID: 9c4e7b1a6d20
+Revises: 3f1c8a2d9b47
+Create Date: 2026-10-18 19:41:07.305582
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = '9c4e7b1a6d20'
+down_revision = '3f1c8a2d9b47'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # the same statement as stats.create_view_sql()
+    op.execute("""
+        CREATE MATERIALIZED VIEW catalog_stats AS
+        SELECT 'movies_by_year' AS metric,
+               CAST(CAST(EXTRACT(year FROM release_date) AS INTEGER)
+                    AS VARCHAR) AS bucket,
+               count(*) AS count
+        FROM movies
+        GROUP BY CAST(CAST(EXTRACT(year FROM release_date) AS INTEGER)
+                      AS VARCHAR)
+        UNION ALL
+        SELECT 'actors_by_gender', gender, count(*)
+        FROM actors
+        GROUP BY gender
+        UNION ALL
+        SELECT 'actors_by_age',
+               CASE WHEN length(age) = 1 THEN '0-9'
+                    WHEN length(age) = 2
+                    THEN substr(age, 1, 1) || '0-' || substr(age, 1, 1) || '9'
+                    ELSE '100+' END,
+               count(*)
+        FROM actors
+        GROUP BY CASE WHEN length(age) = 1 THEN '0-9'
+                      WHEN length(age) = 2
+                      THEN substr(age, 1, 1) || '0-' || substr(age, 1, 1) || '9'
+                      ELSE '100+' END
+        UNION ALL
+        SELECT 'totals', 'movies', count(*) FROM movies
+        UNION ALL
+        SELECT 'totals', 'actors', count(*) FROM actors
+        UNION ALL
+        SELECT 'totals', 'casting', count(*) FROM casting
+        UNION ALL
+        SELECT 'versions', name, version
+        FROM table_versions
+        WHERE name IN ('movies', 'actors')
+    """)
+    op.execute('CREATE UNIQUE INDEX ix_catalog_stats '
+               'ON catalog_stats (metric, bucket)')
+
+
+def downgrade():
+    op.execute('DROP MATERIALIZED VIEW catalog_stats')
@@ -5,7 +5,6 @@ Create Date: 2021-03-02 22:17:02.697495
 """
 from alembic import op
 import sqlalchemy as sa
-from sqlalchemy.dialects import postgresql
 
 # revision identifiers, used by Alembic.
 revision = 'db3e06925564'
@@ -15,25 +14,23 @@ depends_on = None
 
 
 def upgrade():
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.drop_table('movies')
-    op.drop_table('actors')
-    # ### end Alembic commands ###
+    # this revision used to drop the tables, which only worked while
+    # setup_db created them with db.create_all() on every start
+    op.create_table('movies',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('title', sa.String(), nullable=False),
+    sa.Column('release_date', sa.DateTime(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
+    op.create_table('actors',
+    sa.Column('id', sa.Integer(), nullable=False),
+    sa.Column('name', sa.String(), nullable=False),
+    sa.Column('age', sa.String(), nullable=False),
+    sa.Column('gender', sa.String(), nullable=False),
+    sa.PrimaryKeyConstraint('id')
+    )
 
 
 def downgrade():
-    # ### commands auto generated by Alembic - please adjust! ###
-    op.create_table('actors',
-    sa.Column('id', sa.INTEGER(), autoincrement=True, nullable=False),
-    sa.Column('name', sa.VARCHAR(), autoincrement=False, nullable=False),
-    sa.Column('age', sa.VARCHAR(), autoincrement=False, nullable=False),
-    sa.Column('gender', sa.VARCHAR(), autoincrement=False, nullable=False),
-    sa.PrimaryKeyConstraint('id', name='actors_pkey')
-    )
-    op.create_table('movies',
-    sa.Column('id', sa.INTEGER(), autoincrement=True, nullable=False),
-    sa.Column('title', sa.VARCHAR(), autoincrement=False, nullable=False),
-    sa.Column('release_date', postgresql.TIMESTAMP(), autoincrement=False, nullable=False),
-    sa.PrimaryKeyConstraint('id', name='movies_pkey')
-    )
-    # ### end Alembic commands ###
+    op.drop_table('actors')
+    op.drop_table('movies')
@@ -1,24 +1,382 @@
-from sqlalchemy import Column, String, Integer, create_engine, DateTime
+from sqlalchemy import (Column, String, Integer, create_engine, DateTime,
+                        ForeignKey, Index, and_, event, exists, func,
+                        literal, select, true)
+from sqlalchemy import exc
+from sqlalchemy.engine.url import make_url
+from sqlalchemy.orm import sessionmaker
+from sqlalchemy.pool import QueuePool
 from flask_sqlalchemy import SQLAlchemy
+from replicas import ReplicaSet, RoutingSession
 import json
 import os
+import threading
+import time
 
-database_path = os.environ['DATABASE_URL']
+POOL_SETTINGS = {
+    'pool_size': ('DB_POOL_SIZE', int, 5),
+    'max_overflow': ('DB_MAX_OVERFLOW', int, 10),
+    'pool_timeout': ('DB_POOL_TIMEOUT', float, 30),
+    'pool_recycle': ('DB_POOL_RECYCLE', int, 1800),
+    'pool_pre_ping': ('DB_POOL_PRE_PING',
+                      lambda value: value.lower() in ('1', 'true', 'yes'),
+                      True),
+}
 
-db = SQLAlchemy()
+'''
+TimedQueuePool
+    QueuePool that records how long callers wait to get a connection,
+    so pool sizing can be checked against real contention
+'''
+
+
+class TimedQueuePool(QueuePool):
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.waits = 0
+        self.wait_time = 0.0
+        self.max_wait = 0.0
+        self.timeouts = 0
+        self._stats_lock = threading.Lock()
+
+    def _do_get(self):
+        start = time.perf_counter()
+        try:
+            return super()._do_get()
+        except exc.TimeoutError:
+            self.timeouts += 1
+            raise
+        finally:
+            waited = time.perf_counter() - start
+            with self._stats_lock:
+                self.waits += 1
+                self.wait_time += waited
+                self.max_wait = max(self.max_wait, waited)
+
+
+'''
+Database
+    one engine (and so one connection pool) per database url and engine
+    options for the whole process, however many Flask apps are created,
+    and sessions that route GET request reads to the read replicas
+'''
+
+
+class Database(SQLAlchemy):
+    engines = {}
+    _engines_lock = threading.Lock()
+
+    def create_engine(self, sa_url, engine_opts):
+        key = (str(sa_url), repr(sorted(engine_opts.items())))
+        with self._engines_lock:
+            engine = self.engines.get(key)
+            if engine is None:
+                engine = super().create_engine(sa_url, engine_opts)
+                self.engines[key] = engine
+            return engine
+
+    def create_session(self, options):
+        return sessionmaker(class_=RoutingSession, db=self, **options)
+
+
+db = Database()
 
 '''
 setup_db(app)
     binds a flask application and a SQLAlchemy service
+    the database is `database_path`, or else DATABASE_URL. Pool settings
+    come from the keyword arguments, then the DB_POOL_SIZE,
+    DB_MAX_OVERFLOW, DB_POOL_TIMEOUT, DB_POOL_RECYCLE and DB_POOL_PRE_PING
+    environment variables, then the defaults in POOL_SETTINGS. Read
+    replicas come from `replica_paths`, or else the comma separated
+    DATABASE_REPLICA_URLS. Calling it again for an app that is already set
+    up does nothing. Nothing is connected to until the first query, and
+    the schema is left to the migrations (python manage.py db upgrade).
 '''
 
 
-def setup_db(app, database_path=database_path):
+def setup_db(app, database_path=None, replica_paths=None, **pool_options):
+    if 'sqlalchemy' in app.extensions:
+        return
+    if database_path is None:
+        database_path = os.environ['DATABASE_URL']
     app.config["SQLALCHEMY_DATABASE_URI"] = database_path
     app.config["SQLALCHEMY_TRACK_MODIFICATIONS"] = False
+    app.config["SQLALCHEMY_ENGINE_OPTIONS"] = engine_options(
+        database_path, **pool_options)
     db.app = app
     db.init_app(app)
-    db.create_all()
+
+    if replica_paths is None:
+        replica_paths = os.environ.get('DATABASE_REPLICA_URLS', '')
+        replica_paths = [path.strip() for path in replica_paths.split(',')
+                         if path.strip()]
+    app.extensions['replicas'] = ReplicaSet(
+        db.create_engine(make_url(path), engine_options(path, **pool_options))
+        for path in replica_paths)
+
+
+def engine_options(database_path, **pool_options):
+    # SQLite gets Flask-SQLAlchemy's own single connection pool choices
+    if database_path.startswith('sqlite'):
+        return {}
+    options = {'poolclass': TimedQueuePool}
+    for option, (variable, parse, default) in POOL_SETTINGS.items():
+        value = pool_options.get(option)
+        if value is None and variable in os.environ:
+            value = parse(os.environ[variable])
+        options[option] = default if value is None else value
+    return options
+
+
+def pool_stats(engine=None):
+    '''
+    live statistics of the connection pool, for sizing PostgreSQL
+    max_connections against (gunicorn workers x (pool_size + max_overflow))
+    '''
+    pool = (engine or db.engine).pool
+    stats = {'class': type(pool).__name__}
+    if isinstance(pool, QueuePool):
+        stats.update({
+            'size': pool.size(),
+            'checked_in': pool.checkedin(),
+            'checked_out': pool.checkedout(),
+            'overflow': max(pool.overflow(), 0),
+            'max_overflow': pool._max_overflow,
+        })
+    if isinstance(pool, TimedQueuePool):
+        stats.update({
+            'waits': pool.waits,
+            'wait_time': round(pool.wait_time, 6),
+            'max_wait': round(pool.max_wait, 6),
+            'timeouts': pool.timeouts,
+        })
+    return stats
+
+
+'''
+TableVersion
+    a change counter per table, bumped in the same transaction as every
+    write to that table. Together with the per-row `version` columns it
+    gives GET routes a cheap ETag that can be checked without loading
+    any ORM objects.
+'''
+
+
+class TableVersion(db.Model):
+    __tablename__ = 'table_versions'
+
+    name = Column(String, primary_key=True)
+    version = Column(Integer, nullable=False, default=0)
+
+
+@event.listens_for(TableVersion.__table__, 'after_create')
+def seed_table_versions(target, connection, **kwargs):
+    connection.execute(target.insert(), [
+        {'name': 'movies', 'version': 0},
+        {'name': 'actors', 'version': 0},
+    ])
+
+
+def bump_version(name):
+    table = TableVersion.__table__
+    result = db.session.execute(
+        table.update()
+        .where(table.c.name == name)
+        .values(version=table.c.version + 1))
+    if result.rowcount == 0:
+        db.session.add(TableVersion(name=name, version=1))
+
+
+def table_version(name):
+    return db.session.query(TableVersion.version).filter(
+        TableVersion.name == name).scalar() or 0
+
+
+def row_version(model, id):
+    return db.session.query(model.version).filter(model.id == id).scalar()
+
+
+'''
+insert_many(model, rows)
+    inserts a list of column dicts in one transaction and returns them as
+    dicts including their new ids. On PostgreSQL this is a single
+    multi-row INSERT ... RETURNING; other backends fall back to one
+    INSERT per row inside the same transaction.
+'''
+
+
+def insert_many(model, rows):
+    table = model.__table__
+    columns = [column for column in table.columns if column.name != 'version']
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            result = db.session.execute(
+                table.insert().values(rows).returning(*columns))
+            created = [dict(row) for row in result]
+        else:
+            instances = [model(**row) for row in rows]
+            db.session.add_all(instances)
+            db.session.flush()
+            created = [
+                {column.name: getattr(instance, column.key)
+                 for column in columns}
+                for instance in instances]
+        bump_version(table.name)
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return created
+
+
+'''
+update_row(model, id, values, fields) / delete_row(model, id, fields)
+    update the row `id` of `model` with the column values `values`, or
+    delete it, and bump its table version in one transaction. Both return
+    the row's `fields` as a dict (as they are after an update, as they
+    were before a delete), or None when there is no such row. On
+    PostgreSQL each is a single statement: the UPDATE or DELETE ...
+    RETURNING and the version bump are data-modifying CTEs of one query,
+    and the version is only bumped when a row changed. Other backends
+    load the row through the ORM, change it and read it back.
+'''
+
+
+def versioned(table, statement):
+    '''
+    the UPDATE or DELETE ... RETURNING `statement` on `table` and the
+    bump of the table's version, applied only if it matched a row, as one
+    SELECT of the returned row
+    '''
+    changed = statement.cte('changed')
+    versions = TableVersion.__table__
+    bumped = versions.update().where(and_(
+        versions.c.name == table.name,
+        exists(select([literal(1)]).select_from(changed)),
+    )).values(version=versions.c.version + 1).returning(
+        versions.c.version).cte('bumped')
+    # PostgreSQL runs every data-modifying CTE, read or not; the join only
+    # makes SQLAlchemy render this one
+    return select([changed]).select_from(changed.outerjoin(bumped, true()))
+
+
+def execute_returning(table, statement):
+    try:
+        row = db.session.execute(versioned(table, statement)).first()
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return None if row is None else dict(row)
+
+
+def update_row(model, id, values, fields):
+    table = model.__table__
+    if db.engine.dialect.name == 'postgresql':
+        return execute_returning(table, table.update().where(
+            table.c.id == id).values(
+            version=table.c.version + 1, **values).returning(
+            *[table.c[field] for field in fields]))
+
+    instance = model.query.get(id)
+    if instance is None:
+        return None
+    for column, value in values.items():
+        setattr(instance, column, value)
+    instance.update()
+    return {field: getattr(instance, field) for field in fields}
+
+
+def delete_row(model, id, fields):
+    table = model.__table__
+    if db.engine.dialect.name == 'postgresql':
+        return execute_returning(table, table.delete().where(
+            table.c.id == id).returning(
+            *[table.c[field] for field in fields]))
+
+    instance = model.query.get(id)
+    if instance is None:
+        return None
+    row = {field: getattr(instance, field) for field in fields}
+    instance.delete()
+    return row
+
+
+'''
+update_where(model, criteria, values, limit) /
+delete_where(model, criteria, limit)
+    update every row of `model` that matches all of `criteria` with the
+    column values `values`, or delete them, in one set-based statement
+    and one transaction with the table version bump. Both return the
+    number of rows affected, or None, with nothing changed, when more
+    than `limit` rows match: the rows are picked by an id subquery
+    capped at limit + 1, so an over-broad filter never writes more than
+    that before it is rolled back. On PostgreSQL the version bump is a
+    CTE of the same statement (see versioned()); other backends bump it
+    after the UPDATE or DELETE, and delete the casting rows themselves
+    since SQLite does not enforce the ON DELETE CASCADE.
+'''
+
+
+def matching(model, criteria, limit):
+    table = model.__table__
+    return table.c.id.in_(
+        select([table.c.id]).where(and_(*criteria)).limit(limit + 1))
+
+
+def write_where(table, statement, limit):
+    try:
+        if db.engine.dialect.name == 'postgresql':
+            count = db.session.execute(versioned(
+                table, statement.returning(table.c.id)).with_only_columns(
+                [func.count()])).scalar()
+        else:
+            count = db.session.execute(statement).rowcount
+            if count:
+                bump_version(table.name)
+        if count > limit:
+            db.session.rollback()
+            return None
+        db.session.commit()
+    except Exception:
+        db.session.rollback()
+        raise
+    return count
+
+
+def update_where(model, criteria, values, limit):
+    table = model.__table__
+    return write_where(table, table.update().where(
+        matching(model, criteria, limit)).values(
+        version=table.c.version + 1, **values), limit)
+
+
+def delete_where(model, criteria, limit):
+    table = model.__table__
+    if db.engine.dialect.name != 'postgresql':
+        for key in casting.foreign_keys:
+            if key.references(table):
+                db.session.execute(casting.delete().where(key.parent.in_(
+                    select([table.c.id]).where(and_(*criteria)))))
+    return write_where(table, table.delete().where(
+        matching(model, criteria, limit)), limit)
+
+
+'''
+casting
+    association of movies and the actors cast in them, one row per pair.
+    The primary key serves movie -> actors lookups and ix_casting_actor_id
+    the reverse direction.
+'''
+
+casting = db.Table(
+    'casting',
+    Column('movie_id', Integer, ForeignKey('movies.id', ondelete='CASCADE'),
+           primary_key=True),
+    Column('actor_id', Integer, ForeignKey('actors.id', ondelete='CASCADE'),
+           primary_key=True),
+    Index('ix_casting_actor_id', 'actor_id', 'movie_id'),
+)
 
 
 '''
@@ -33,6 +391,18 @@ class Movie(db.Model):
     id = Column(Integer, primary_key=True)
     title = Column(String, nullable=False)
     release_date = Column(DateTime, nullable=False)
+    version = Column(Integer, nullable=False, server_default='1')
+    actors = db.relationship('Actor', secondary=casting, order_by='Actor.id',
+                             backref=db.backref('movies',
+                                                order_by='Movie.id'))
+
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        Index('ix_movies_release_date', 'release_date', 'id'),
+        Index('ix_movies_title', 'title', 'id'),
+        Index('ix_movies_title_prefix', 'title',
+              postgresql_ops={'title': 'varchar_pattern_ops'}),
+    )
 
     def __init__(self, title, release_date):
         self.title = title
@@ -40,13 +410,48 @@ class Movie(db.Model):
 
     def insert(self):
         db.session.add(self)
+        bump_version(self.__tablename__)
         db.session.commit()
 
+    @classmethod
+    def insert_many(cls, rows):
+        return insert_many(cls, rows)
+
+    @classmethod
+    def update_row(cls, id, values, fields):
+        return update_row(cls, id, values, fields)
+
+    @classmethod
+    def delete_row(cls, id, fields):
+        return delete_row(cls, id, fields)
+
+    @classmethod
+    def update_where(cls, criteria, values, limit):
+        return update_where(cls, criteria, values, limit)
+
+    @classmethod
+    def delete_where(cls, criteria, limit):
+        return delete_where(cls, criteria, limit)
+
     def update(self):
+        bump_version(self.__tablename__)
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        bump_version(self.__tablename__)
+        db.session.commit()
+
+    def cast(self, actor):
+        self.actors.append(actor)
+        bump_version(self.__tablename__)
+        bump_version(actor.__tablename__)
+        db.session.commit()
+
+    def uncast(self, actor):
+        self.actors.remove(actor)
+        bump_version(self.__tablename__)
+        bump_version(actor.__tablename__)
         db.session.commit()
 
     def format(self):
@@ -63,6 +468,15 @@ class Actor(db.Model):
     name = Column(String, nullable=False)
     age = Column(String, nullable=False)
     gender = Column(String, nullable=False)
+    version = Column(Integer, nullable=False, server_default='1')
+
+    __mapper_args__ = {'version_id_col': version}
+    __table_args__ = (
+        Index('ix_actors_name', 'name', 'id'),
+        Index('ix_actors_name_prefix', 'name',
+              postgresql_ops={'name': 'varchar_pattern_ops'}),
+        Index('ix_actors_gender', 'gender', 'id'),
+    )
 
     def __init__(self, name, age, gender):
         self.name = name
@@ -71,13 +485,36 @@ class Actor(db.Model):
 
     def insert(self):
         db.session.add(self)
+        bump_version(self.__tablename__)
         db.session.commit()
 
+    @classmethod
+    def insert_many(cls, rows):
+        return insert_many(cls, rows)
+
+    @classmethod
+    def update_row(cls, id, values, fields):
+        return update_row(cls, id, values, fields)
+
+    @classmethod
+    def delete_row(cls, id, fields):
+        return delete_row(cls, id, fields)
+
+    @classmethod
+    def update_where(cls, criteria, values, limit):
+        return update_where(cls, criteria, values, limit)
+
+    @classmethod
+    def delete_where(cls, criteria, limit):
+        return delete_where(cls, criteria, limit)
+
     def update(self):
+        bump_version(self.__tablename__)
         db.session.commit()
 
     def delete(self):
         db.session.delete(self)
+        bump_version(self.__tablename__)
         db.session.commit()
 
     def format(self):
@@ -85,3 +522,7 @@ class Actor(db.Model):
             'name': self.name,
             'age': self.age,
             'gender': self.gender}
+
+
+# actors.age is a string; it is ordered as (length(age), age), see filters.py
+Index('ix_actors_age', func.length(Actor.age), Actor.age, Actor.id)
@@ -0,0 +1,118 @@
+import base64
+import binascii
+import datetime
+import json
+import os
+from flask import request, abort
+from sqlalchemy import tuple_
+
+DEFAULT_PAGE_SIZE = int(os.environ.get('DEFAULT_PAGE_SIZE', 50))
+MAX_PAGE_SIZE = int(os.environ.get('MAX_PAGE_SIZE', 500))
+
+'''
+Keyset pagination
+    list routes take `?limit=` and an opaque `?after=` cursor. The cursor
+    carries the sort key values of the last row of the previous page, so
+    every page is a `WHERE key > :cursor ORDER BY key LIMIT n` index range
+    scan and page N costs the same as page 1.
+'''
+
+
+def encode_cursor(values):
+    values = [value.isoformat() if isinstance(value, datetime.datetime)
+              else value for value in values]
+    raw = json.dumps(values, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(raw).rstrip(b'=').decode()
+
+
+def decode_cursor(cursor):
+    padded = cursor + '=' * (-len(cursor) % 4)
+    try:
+        values = json.loads(base64.urlsafe_b64decode(padded.encode()))
+    except (binascii.Error, ValueError):
+        abort(400)
+    if not isinstance(values, list):
+        abort(400)
+    return values
+
+
+def coerce(key, value):
+    '''
+    convert a decoded cursor value back to the python type of its column
+    '''
+    try:
+        python_type = key.type.python_type
+        if python_type is datetime.datetime:
+            return datetime.datetime.fromisoformat(value)
+        return python_type(value)
+    except (TypeError, ValueError):
+        abort(400)
+
+
+def parse_limit(value):
+    '''
+    the page size of a `?limit=` value: DEFAULT_PAGE_SIZE when it is
+    absent, capped at MAX_PAGE_SIZE, and a 400 unless it is a positive
+    integer, so a typo is not quietly served a different page size
+    '''
+    if value is None:
+        return DEFAULT_PAGE_SIZE
+    if not (value.isascii() and value.isdigit()) or int(value) < 1:
+        abort(400)
+    return min(int(value), MAX_PAGE_SIZE)
+
+
+def page_args():
+    '''
+    read and validate `limit` and `after` from the query string
+    '''
+    limit = parse_limit(request.args.get('limit'))
+
+    after = request.args.get('after')
+    if after is not None:
+        after = decode_cursor(after)
+    return limit, after
+
+
+def keyset_criterion(keys, after, descending=False):
+    '''
+    the WHERE clause that starts a page right after the cursor `after`
+    '''
+    if len(after) != len(keys):
+        abort(400)
+    after = [coerce(key, value) for key, value in zip(keys, after)]
+    if len(keys) == 1:
+        position, cursor = keys[0], after[0]
+    else:
+        position, cursor = tuple_(*keys), tuple_(*after)
+    return position < cursor if descending else position > cursor
+
+
+def ordering(keys, descending=False):
+    return [key.desc() for key in keys] if descending else list(keys)
+
+
+def paginate(query, keys, limit, after=None, descending=False):
+    '''
+    paginate(query, keys, limit, after, descending)
+        runs one page of `query` ordered by `keys` (unique together)
+        returns the rows of the page and the cursor for the next one,
+        which is None on the last page; a query for one entity gives its
+        instances, any other query its row tuples
+    '''
+    descriptions = query.column_descriptions
+    width = len(descriptions)
+    entity = width == 1 and isinstance(descriptions[0]['type'], type)
+    if after is not None:
+        query = query.filter(keyset_criterion(keys, after, descending))
+
+    query = query.add_columns(*keys).order_by(*ordering(keys, descending))
+    rows = query.limit(limit + 1).all()
+
+    next_cursor = None
+    if len(rows) > limit:
+        rows = rows[:limit]
+        next_cursor = encode_cursor(list(rows[-1][width:]))
+    if entity:
+        return [row[0] for row in rows], next_cursor
+    return [row[:width] for row in rows], next_cursor
@@ -0,0 +1,108 @@
+from flask import abort
+from sqlalchemy.orm import selectinload
+from models import db, Movie, Actor
+
+'''
+Sparse fieldsets and expansions
+    `?fields=id,title` on the list and detail routes. Only the named
+    columns are SELECTed and each response object is built straight from
+    the row tuple, so narrow reads skip loading the other columns, building
+    ORM instances and the identity map. Without `?fields=` the routes
+    read the columns of `format()` the same way.
+
+    `?include=actors` on GET /movies (and `?include=movies` on GET /actors)
+    adds the related rows to each object. They are loaded with
+    `selectinload`, one extra SELECT ... WHERE id IN (...) for the whole
+    page, so the number of queries does not grow with the page size.
+'''
+
+MOVIE_FIELDS = ('id', 'title', 'release_date')
+ACTOR_FIELDS = ('id', 'name', 'age', 'gender')
+MOVIE_INCLUDES = ('actors',)
+ACTOR_INCLUDES = ('movies',)
+
+# the keys of Movie.format() and Actor.format()
+FORMAT_FIELDS = {
+    Movie: ('id', 'title', 'release_date'),
+    Actor: ('name', 'age', 'gender'),
+}
+
+
+def parse_fields(allowed, value):
+    '''
+    parse_fields(allowed, value)
+        maps a comma separated `?fields=` (or `?include=`) value to the
+        list of requested names, in order and without duplicates
+        returns None when `value` is None; unknown or empty lists are a 400
+    '''
+    if value is None:
+        return None
+    fields = []
+    for field in value.split(','):
+        field = field.strip()
+        if field not in allowed:
+            abort(400)
+        if field not in fields:
+            fields.append(field)
+    return fields
+
+
+def project(model, fields):
+    '''
+    a query for just the `fields` columns of `model`, returning row tuples
+    '''
+    return db.session.query(*[getattr(model, field) for field in fields])
+
+
+def row_format(fields):
+    '''
+    the function that turns a row of `project(model, fields)` into a dict
+    '''
+    def format_row(row):
+        return dict(zip(fields, row))
+    return format_row
+
+
+def find(model, id, fields):
+    '''
+    find(model, id, fields)
+        the formatted row `id` of `model`, projected to `fields` (all of
+        `format()` if None), or None if there is no such row
+    '''
+    fields = fields or FORMAT_FIELDS[model]
+    row = project(model, fields).filter(model.id == id).first()
+    return None if row is None else row_format(fields)(row)
+
+
+def summary(instance):
+    return dict(instance.format(), id=instance.id)
+
+
+def include_format(includes):
+    '''
+    the function that formats an instance with its `includes` relationships
+    '''
+    def format_row(instance):
+        formatted = instance.format()
+        for name in includes:
+            formatted[name] = [summary(item)
+                               for item in getattr(instance, name)]
+        return formatted
+    return format_row
+
+
+def shaped(model, fields, includes):
+    '''
+    shaped(model, fields, includes)
+        the base query of a list route and the function that formats its
+        rows: a column projection of `fields` (all of `format()` if None),
+        or instances with their `includes` relationships eagerly loaded
+        `fields` and `includes` cannot be combined
+    '''
+    if fields is not None and includes is not None:
+        abort(400)
+    if includes is not None:
+        options = [selectinload(getattr(model, name)) for name in includes]
+        return model.query.options(*options), include_format(includes)
+    fields = fields or FORMAT_FIELDS[model]
+    return project(model, fields), row_format(fields)
@@ -0,0 +1,138 @@
+import logging
+import os
+import threading
+import warnings
+from time import perf_counter
+from flask import has_request_context, request
+from sqlalchemy import event
+from sqlalchemy.engine import Engine
+
+logger = logging.getLogger(__name__)
+
+SLOW_QUERY_SECONDS = float(os.environ.get('SLOW_QUERY_MS', 100)) / 1000
+QUERY_REPEAT_LIMIT = int(os.environ.get('QUERY_REPEAT_LIMIT', 5))
+QUERY_HEADERS = os.environ.get('QUERY_HEADERS', '').lower() in (
+    '1', 'true', 'yes')
+
+'''
+Query log
+    SQLAlchemy engine events count every statement a request runs, on any
+    engine, and add up the time spent executing them:
+
+    - a statement slower than SLOW_QUERY_MS milliseconds (default 100) is
+      logged with the route and the types of its bound parameters, never
+      their values.
+    - in debug or testing mode, a RepeatedQueryWarning is raised the first
+      time a request runs the same statement more than QUERY_REPEAT_LIMIT
+      times (default 5): the N+1 pattern of loading rows one by one, such
+      as a lazy relationship or a row expired by commit() read in a loop.
+    - with QUERY_HEADERS set (or in debug or testing mode) responses carry
+      the count in X-Query-Count and the timings in Server-Timing, so a
+      test or a browser can see an accidental extra round trip.
+'''
+
+
+class RepeatedQueryWarning(UserWarning):
+    pass
+
+
+_local = threading.local()
+
+
+def start_request(detect_repeats=False):
+    # [statements, seconds, {statement: runs} or None]
+    _local.log = [0, 0.0, {} if detect_repeats else None]
+    _local.start = perf_counter()
+
+
+def current():
+    '''
+    (statements, seconds) run so far by the current request, or None
+    outside a request
+    '''
+    log = getattr(_local, 'log', None)
+    if log is None:
+        return None
+    return log[0], log[1]
+
+
+def route():
+    if not has_request_context():
+        return '-'
+    rule = request.url_rule
+    return f'{request.method} {rule.rule if rule is not None else "-"}'
+
+
+def parameter_shapes(parameters, executemany=False):
+    '''
+    the types of a statement's bound parameters, for logging
+    '''
+    if executemany:
+        if not parameters:
+            return '[]'
+        return f'{len(parameters)} x {parameter_shapes(parameters[0])}'
+    if isinstance(parameters, dict):
+        return '{%s}' % ', '.join(f'{name}: {type(value).__name__}'
+                                  for name, value in parameters.items())
+    return '(%s)' % ', '.join(type(value).__name__ for value in parameters)
+
+
+@event.listens_for(Engine, 'before_cursor_execute')
+def before_cursor_execute(connection, cursor, statement, parameters,
+                          context, executemany):
+    _local.query_start = perf_counter()
+
+
+@event.listens_for(Engine, 'after_cursor_execute')
+def after_cursor_execute(connection, cursor, statement, parameters,
+                         context, executemany):
+    elapsed = perf_counter() - _local.query_start
+    if elapsed >= SLOW_QUERY_SECONDS:
+        logger.warning('Slow query (%.1f ms) on %s: %s %s', elapsed * 1000,
+                       route(), statement,
+                       parameter_shapes(parameters, executemany))
+
+    log = getattr(_local, 'log', None)
+    if log is None:
+        return
+    log[0] += 1
+    log[1] += elapsed
+
+    shapes = log[2]
+    if shapes is not None:
+        repeats = shapes[statement] = shapes.get(statement, 0) + 1
+        if repeats == QUERY_REPEAT_LIMIT + 1:
+            warnings.warn(
+                f'{route()} ran the same statement more than '
+                f'{QUERY_REPEAT_LIMIT} times: {statement}',
+                RepeatedQueryWarning)
+
+
+def timing_headers(response):
+    count, seconds = current()
+    response.headers['X-Query-Count'] = str(count)
+    response.headers['Server-Timing'] = (
+        f'db;dur={seconds * 1000:.2f};desc="{count} queries", '
+        f'app;dur={(perf_counter() - _local.start) * 1000:.2f}')
+    return response
+
+
+def init_app(app):
+    '''
+    count the statements of every request of `app`; register it before
+    metrics.init_app so the counts are still there when metrics records
+    the request
+    '''
+    def start():
+        start_request(app.debug or app.testing)
+
+    def finish(response):
+        if ((QUERY_HEADERS or app.debug or app.testing) and
+                current() is not None):
+            timing_headers(response)
+        # statements run after this, while streaming a body, are not counted
+        _local.log = None
+        return response
+
+    app.before_request(start)
+    app.after_request(finish)
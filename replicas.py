@@ -0,0 +1,165 @@
+import itertools
+import logging
+import os
+import threading
+import time
+from flask import has_request_context, request
+from flask_sqlalchemy import SignallingSession
+from sqlalchemy import event, select
+from sqlalchemy.sql.expression import Select, CompoundSelect
+from background import BackgroundThread
+
+logger = logging.getLogger(__name__)
+
+READ_METHODS = ('GET', 'HEAD')
+
+'''
+Read replicas
+    DATABASE_REPLICA_URLS is a comma separated list of read replicas of
+    DATABASE_URL. SELECTs made while serving a GET (or HEAD) request go to
+    one replica, chosen round-robin per request, so every read of a
+    request sees the same snapshot source. Everything else stays on the
+    primary: writes, SELECT ... FOR UPDATE, work outside a request, and
+    every statement of a request after it has written anything, so a
+    request always reads its own writes.
+
+    A background thread checks each replica every REPLICA_CHECK_INTERVAL
+    seconds and takes unreachable ones out of the rotation until they
+    answer again. A request only probes the replica it picks (one pool
+    checkout) when that replica has not passed a check or probe within the
+    interval, e.g. before the thread has started; one that fails the
+    probe, or whose connection fails mid-request, is taken out at once.
+    With no healthy replica, reads fall back to the primary.
+'''
+
+
+class ReplicaSet:
+    def __init__(self, engines=(), check_interval=None):
+        if check_interval is None:
+            check_interval = os.environ.get('REPLICA_CHECK_INTERVAL', 5)
+        self.engines = list(engines)
+        self.check_interval = float(check_interval)
+        self.healthy = list(self.engines)
+        self.counters = {
+            'reads': 0,
+            'fallbacks': 0,
+            'checks': 0,
+            'probes': 0,
+            'failures': 0,
+        }
+        # engine -> time.monotonic() of its last successful check or probe
+        self._checked = {}
+        self._next = itertools.count()
+        self._lock = threading.Lock()
+        self._thread = BackgroundThread('replica-check', self._check_loop)
+        for engine in self.engines:
+            event.listen(engine, 'handle_error', self._on_error)
+
+    def choose(self):
+        '''
+        the next healthy replica that hands out a connection, or None to
+        read from the primary
+        '''
+        while self.healthy:
+            healthy = self.healthy
+            engine = healthy[next(self._next) % len(healthy)]
+            if not self.recently_checked(engine):
+                self.counters['probes'] += 1
+                try:
+                    # a pool checkout; the request's reads reuse the
+                    # connection
+                    engine.connect().close()
+                except Exception:
+                    self.mark_down(engine)
+                    continue
+                self._checked[engine] = time.monotonic()
+            self.counters['reads'] += 1
+            return engine
+        if self.engines:
+            self.counters['fallbacks'] += 1
+        return None
+
+    def check(self):
+        '''
+        run a health check against every replica and update the rotation
+        '''
+        self.counters['checks'] += 1
+        healthy = []
+        for engine in self.engines:
+            try:
+                with engine.connect() as connection:
+                    connection.execute(select([1])).scalar()
+            except Exception:
+                self.counters['failures'] += 1
+                logger.warning('Replica %r failed its health check',
+                               engine.url, exc_info=True)
+            else:
+                healthy.append(engine)
+                self._checked[engine] = time.monotonic()
+        self.healthy = healthy
+        return healthy
+
+    def recently_checked(self, engine):
+        checked = self._checked.get(engine)
+        return (checked is not None and
+                time.monotonic() - checked < self.check_interval)
+
+    def mark_down(self, engine):
+        with self._lock:
+            if engine in self.healthy:
+                self.counters['failures'] += 1
+                self.healthy = [other for other in self.healthy
+                                if other is not engine]
+                logger.warning('Replica %r taken out of rotation', engine.url)
+
+    def _on_error(self, context):
+        if context.is_disconnect or context.connection is None:
+            self.mark_down(context.engine)
+
+    def start(self):
+        '''
+        start the health check thread for the current process, if there
+        are replicas to check
+        '''
+        if self.engines:
+            self._thread.start()
+
+    def _check_loop(self):
+        while True:
+            try:
+                self.check()
+            except Exception:
+                logger.exception('Replica health check failed')
+            time.sleep(self.check_interval)
+
+    def stats(self):
+        return dict(self.counters, replicas=len(self.engines),
+                    healthy=len(self.healthy))
+
+
+def is_read(clause):
+    return (isinstance(clause, (Select, CompoundSelect)) and
+            getattr(clause, '_for_update_arg', None) is None)
+
+
+'''
+RoutingSession
+    the Flask-SQLAlchemy session with replica routing in get_bind
+'''
+
+
+class RoutingSession(SignallingSession):
+    def get_bind(self, mapper=None, clause=None):
+        primary = super().get_bind(mapper, clause)
+        if self._flushing or (clause is not None and not is_read(clause)):
+            self.info['pinned'] = True
+            return primary
+        if (clause is None or self.info.get('pinned') or
+                not has_request_context() or
+                request.method not in READ_METHODS):
+            return primary
+
+        if 'replica' not in self.info:
+            replicas = self.app.extensions.get('replicas')
+            self.info['replica'] = replicas and replicas.choose()
+        return self.info['replica'] or primary
@@ -0,0 +1,70 @@
+from sqlalchemy import DDL, event, func, literal, or_
+from models import db, Movie, Actor
+
+'''
+Full-text search
+    movies.title and actors.name are matched two ways on PostgreSQL: a
+    tsvector expression index answers word matches and a pg_trgm trigram
+    index answers fuzzy (misspelled or partial) matches. Rows are ranked
+    by ts_rank + trigram similarity. Both are GIN expression indexes, so
+    PostgreSQL keeps them current on every INSERT/UPDATE without triggers
+    or a stored tsvector column.
+
+    Other backends (the SQLite test databases) fall back to a
+    case-insensitive substring match ordered by id.
+'''
+
+TEXT_SEARCH_CONFIG = 'simple'
+
+SEARCH_INDEXES = {
+    Movie: ('ix_movies_title_fts', 'ix_movies_title_trgm'),
+    Actor: ('ix_actors_name_fts', 'ix_actors_name_trgm'),
+}
+
+
+def search_column(model):
+    return Movie.title if model is Movie else Actor.name
+
+
+def search_ddl(model):
+    column = search_column(model).name
+    table = model.__tablename__
+    fts, trgm = SEARCH_INDEXES[model]
+    return [
+        DDL('CREATE EXTENSION IF NOT EXISTS pg_trgm'),
+        DDL(f'CREATE INDEX IF NOT EXISTS {fts} ON {table} USING gin '
+            f"(to_tsvector('{TEXT_SEARCH_CONFIG}', {column}))"),
+        DDL(f'CREATE INDEX IF NOT EXISTS {trgm} ON {table} USING gin '
+            f'({column} gin_trgm_ops)'),
+    ]
+
+
+for model in SEARCH_INDEXES:
+    for ddl in search_ddl(model):
+        event.listen(model.__table__, 'after_create',
+                     ddl.execute_if(dialect='postgresql'))
+
+
+def search(model, q, limit, offset):
+    '''
+    search(model, q, limit, offset)
+        returns one page of (instance, rank) pairs for `q`, best first,
+        fetching one extra row so the caller can tell if there is more
+    '''
+    column = search_column(model)
+
+    if db.engine.dialect.name != 'postgresql':
+        query = db.session.query(model, literal(0.0)).filter(
+            func.lower(column).contains(q.lower(), autoescape=True))
+        query = query.order_by(model.id)
+        return query.offset(offset).limit(limit + 1).all()
+
+    vector = func.to_tsvector(TEXT_SEARCH_CONFIG, column)
+    tsquery = func.plainto_tsquery(TEXT_SEARCH_CONFIG, q)
+    rank = (func.ts_rank(vector, tsquery) +
+            func.similarity(column, q)).label('rank')
+    # `%` is pg_trgm's similarity operator, served by the trigram index
+    query = db.session.query(model, rank).filter(
+        or_(vector.op('@@')(tsquery), column % q))
+    return query.order_by(rank.desc(), model.id).offset(offset).limit(
+        limit + 1).all()
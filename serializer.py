@@ -0,0 +1,96 @@
+import datetime
+import functools
+import json
+import os
+from time import perf_counter
+from flask import current_app, jsonify as flask_jsonify
+import metrics
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+'''
+Serializer
+    the JSON encoding used by every route. The output is byte for byte
+    what `flask.jsonify` produces with the default config (sorted keys,
+    compact separators, ASCII only, dates as HTTP dates, trailing newline),
+    but dates are formatted once per distinct value and the encoding is
+    done by orjson when it is installed.
+
+    JSON_BACKEND picks the backend: `orjson` (the default when available)
+    or `json` for the standard library. orjson does not escape non-ASCII
+    text or DEL and rejects some values the standard library accepts;
+    those documents are re-encoded with the standard library. orjson
+    writes floats the same way only for 1e-4 <= |x| < 1e16 and NaN as
+    null: the only floats any route returns are search ranks, rounded to
+    4 places and within that range.
+'''
+
+WEEKDAYS = ('Mon', 'Tue', 'Wed', 'Thu', 'Fri', 'Sat', 'Sun')
+MONTHS = ('Jan', 'Feb', 'Mar', 'Apr', 'May', 'Jun',
+          'Jul', 'Aug', 'Sep', 'Oct', 'Nov', 'Dec')
+
+
+@functools.lru_cache(maxsize=4096)
+def http_date(value):
+    '''
+    the HTTP date flask's JSONEncoder writes for a date or datetime
+    '''
+    if isinstance(value, datetime.datetime):
+        value = value.utctimetuple()
+    else:
+        value = value.timetuple()
+    return (f'{WEEKDAYS[value.tm_wday]}, {value.tm_mday:02d} '
+            f'{MONTHS[value.tm_mon - 1]} {value.tm_year:04d} '
+            f'{value.tm_hour:02d}:{value.tm_min:02d}:{value.tm_sec:02d} GMT')
+
+
+def default(value):
+    if isinstance(value, datetime.date):
+        return http_date(value)
+    raise TypeError(f'Object of type {type(value).__name__} '
+                    'is not JSON serializable')
+
+
+def dumps_json(data):
+    return json.dumps(data, default=default, sort_keys=True,
+                      separators=(',', ':')).encode()
+
+
+def dumps_orjson(data):
+    try:
+        encoded = orjson.dumps(data, default=default, option=(
+            orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME))
+    except TypeError:
+        return dumps_json(data)
+    if not encoded.isascii() or b'\x7f' in encoded:
+        return dumps_json(data)
+    return encoded
+
+
+BACKENDS = {'json': dumps_json}
+if orjson is not None:
+    BACKENDS['orjson'] = dumps_orjson
+
+backend = os.environ.get('JSON_BACKEND',
+                         'orjson' if orjson is not None else 'json')
+dumps = BACKENDS[backend]
+
+
+def jsonify(data):
+    '''
+    jsonify(data)
+        a drop-in for flask.jsonify of a single value; pretty printing
+        (debug mode or JSONIFY_PRETTYPRINT_REGULAR) is left to flask
+    '''
+    if (current_app.config['JSONIFY_PRETTYPRINT_REGULAR'] or
+            current_app.debug):
+        return flask_jsonify(data)
+    start = perf_counter()
+    body = dumps(data) + b'\n'
+    metrics.add('serialize', perf_counter() - start)
+    return current_app.response_class(
+        body,
+        mimetype=current_app.config['JSONIFY_MIMETYPE'])
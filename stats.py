@@ -0,0 +1,197 @@
+import logging
+import os
+import time
+from sqlalchemy import (DDL, Column, Integer, MetaData, String, Table, and_,
+                        case, cast, event, extract, func, literal, select,
+                        union_all)
+from sqlalchemy.dialects import postgresql
+from background import BackgroundThread
+from models import db, casting, Movie, Actor, TableVersion
+
+logger = logging.getLogger(__name__)
+
+'''
+Catalog statistics
+    GET /stats reads a few dozen pre-aggregated rows from the catalog_stats
+    materialized view, so it answers in constant time whatever the size of
+    movies and actors. The view also stores the table_versions it was built
+    from. A background thread in each worker compares them with the live
+    versions every STATS_REFRESH_INTERVAL seconds and, once a write has
+    happened, runs REFRESH MATERIALIZED VIEW CONCURRENTLY, which does not
+    block readers. An advisory lock keeps workers from refreshing at the
+    same time, and a burst of writes within one interval costs one refresh.
+
+    Other backends (the SQLite test databases) run the same aggregate
+    query live.
+'''
+
+STATS_VIEW = 'catalog_stats'
+STATS_LOCK = 7350110
+TRACKED_TABLES = ('movies', 'actors')
+
+catalog_stats = Table(
+    STATS_VIEW, MetaData(),
+    Column('metric', String),
+    Column('bucket', String),
+    Column('count', Integer),
+)
+
+
+def age_bucket():
+    '''
+    actors.age is a string of digits; bucket it by decade without a cast
+    '''
+    length = func.length(Actor.age)
+    tens = func.substr(Actor.age, 1, 1, type_=String)
+    return case([
+        (length == 1, '0-9'),
+        (length == 2, tens + '0-' + tens + '9'),
+    ], else_='100+')
+
+
+def stats_select():
+    year = cast(cast(extract('year', Movie.release_date), Integer), String)
+    age = age_bucket()
+
+    def grouped(metric, model, bucket):
+        return select([literal(metric).label('metric'),
+                       bucket.label('bucket'),
+                       func.count().label('count')]).select_from(
+            model.__table__).group_by(bucket)
+
+    def total(name, table):
+        return select([literal('totals').label('metric'),
+                       literal(name).label('bucket'),
+                       func.count().label('count')]).select_from(table)
+
+    versions = TableVersion.__table__
+    return union_all(
+        grouped('movies_by_year', Movie, year),
+        grouped('actors_by_gender', Actor, Actor.gender),
+        grouped('actors_by_age', Actor, age),
+        total('movies', Movie.__table__),
+        total('actors', Actor.__table__),
+        total('casting', casting),
+        select([literal('versions').label('metric'),
+                versions.c.name.label('bucket'),
+                versions.c.version.label('count')]).where(
+            versions.c.name.in_(TRACKED_TABLES)),
+    )
+
+
+def create_view_sql():
+    statement = stats_select().compile(
+        dialect=postgresql.dialect(),
+        compile_kwargs={'literal_binds': True})
+    return f'CREATE MATERIALIZED VIEW IF NOT EXISTS {STATS_VIEW} AS {statement}'
+
+
+# REFRESH ... CONCURRENTLY needs a unique index on the view
+event.listen(db.metadata, 'after_create',
+             DDL(create_view_sql()).execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'after_create',
+             DDL(f'CREATE UNIQUE INDEX IF NOT EXISTS ix_{STATS_VIEW} '
+                 f'ON {STATS_VIEW} (metric, bucket)')
+             .execute_if(dialect='postgresql'))
+event.listen(db.metadata, 'before_drop',
+             DDL(f'DROP MATERIALIZED VIEW IF EXISTS {STATS_VIEW}')
+             .execute_if(dialect='postgresql'))
+
+
+def load_stats():
+    '''
+    the catalog statistics as {metric: {bucket: count}}
+    '''
+    if db.engine.dialect.name == 'postgresql':
+        rows = db.session.execute(select([catalog_stats]))
+    else:
+        rows = db.session.execute(stats_select())
+
+    stats = {
+        'movies_by_year': {},
+        'actors_by_gender': {},
+        'actors_by_age': {},
+        'totals': {'movies': 0, 'actors': 0, 'casting': 0},
+    }
+    for metric, bucket, count in rows:
+        if metric in stats:
+            stats[metric][bucket] = count
+    return stats
+
+
+'''
+StatsRefresher
+    the background thread that keeps catalog_stats current, one per process
+'''
+
+
+class StatsRefresher:
+    def __init__(self, interval=None):
+        if interval is None:
+            interval = os.environ.get('STATS_REFRESH_INTERVAL', 5)
+        self.interval = float(interval)
+        self.counters = {
+            'checks': 0,
+            'refreshes': 0,
+            'refresh_errors': 0,
+        }
+        self.refreshed_at = None
+        self._engine = None
+        self._thread = BackgroundThread('stats-refresh', self._refresh_loop)
+
+    def start(self, engine):
+        '''
+        start the refresh thread of `engine` for the current process, on
+        PostgreSQL only
+        '''
+        if engine.dialect.name != 'postgresql' or self._thread.running():
+            return
+        self._engine = engine
+        self._thread.start()
+
+    def stale(self, connection):
+        versions = TableVersion.__table__
+        built = catalog_stats.alias('built')
+        query = select([func.count()]).select_from(
+            versions.outerjoin(built, and_(
+                built.c.metric == 'versions',
+                built.c.bucket == versions.c.name))
+        ).where(and_(
+            versions.c.name.in_(TRACKED_TABLES),
+            built.c.count.is_distinct_from(versions.c.version)))
+        return connection.execute(query).scalar() > 0
+
+    def refresh(self):
+        '''
+        refresh catalog_stats if a tracked table changed since it was built
+        returns whether this call refreshed it
+        '''
+        self.counters['checks'] += 1
+        with self._engine.connect() as connection:
+            with connection.begin():
+                locked = connection.execute(select(
+                    [func.pg_try_advisory_xact_lock(STATS_LOCK)])).scalar()
+                # another worker is refreshing, or nothing changed
+                if not locked or not self.stale(connection):
+                    return False
+                connection.execute(
+                    f'REFRESH MATERIALIZED VIEW CONCURRENTLY {STATS_VIEW}')
+        self.counters['refreshes'] += 1
+        self.refreshed_at = time.time()
+        return True
+
+    def _refresh_loop(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.refresh()
+            except Exception:
+                self.counters['refresh_errors'] += 1
+                logger.warning('Unable to refresh %s', STATS_VIEW,
+                               exc_info=True)
+
+    def stats(self):
+        return dict(self.counters, refreshed_at=self.refreshed_at)
+
+
+stats_refresher = StatsRefresher()
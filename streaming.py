@@ -0,0 +1,43 @@
+import os
+from flask import Response, request, stream_with_context
+from serializer import dumps
+
+NDJSON = 'application/x-ndjson'
+STREAM_CHUNK_SIZE = int(os.environ.get('STREAM_CHUNK_SIZE', 500))
+
+'''
+NDJSON streaming
+    full-table reads for sync jobs. Rows are fetched through a server-side
+    cursor (`stream_results` + `yield_per`) and written out as one JSON
+    object per line, flushed every STREAM_CHUNK_SIZE rows, so worker memory
+    stays flat regardless of table size. The first row is flushed on its
+    own so the client gets its first byte as soon as the query returns.
+'''
+
+
+def wants_stream():
+    if request.args.get('stream') in ('1', 'true'):
+        return True
+    best = request.accept_mimetypes.best_match(['application/json', NDJSON])
+    return best == NDJSON
+
+
+def stream_rows(query, format_row, chunk_size=STREAM_CHUNK_SIZE):
+    rows = iter(query.execution_options(stream_results=True)
+                .yield_per(chunk_size))
+
+    def generate():
+        for row in rows:
+            yield dumps(format_row(row)) + b'\n'
+            break
+
+        lines = []
+        for row in rows:
+            lines.append(dumps(format_row(row)))
+            if len(lines) >= chunk_size:
+                yield b'\n'.join(lines) + b'\n'
+                lines = []
+        if lines:
+            yield b'\n'.join(lines) + b'\n'
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON)
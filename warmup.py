@@ -0,0 +1,114 @@
+import logging
+import os
+import threading
+from time import perf_counter
+from sqlalchemy import select
+from sqlalchemy.orm import configure_mappers
+from sqlalchemy.pool import QueuePool
+import auth
+from models import db
+from stats import stats_refresher
+import metrics
+
+logger = logging.getLogger(__name__)
+
+'''
+Warm-up
+    the work a worker process would otherwise do on its first requests:
+
+    - start the metrics flush, replica check and stats refresh threads,
+      and the signing key refresh thread, whether or not the rest works
+    - fetch the Auth0 signing keys
+    - open DB_POOL_SIZE connections to the primary and to each read
+      replica, so the first requests do not pay for connecting
+    - configure the ORM mappers
+
+    gunicorn.conf.py runs it in every worker before the worker accepts
+    connections; other servers run it on their first request. Until it
+    has succeeded in the current process, GET /health/ready answers 503,
+    and each call retries it, so a worker that started while Auth0 or
+    the database was unreachable turns ready once they are back. A retry
+    refetches the signing keys at most once per
+    JWKS_MIN_REFRESH_INTERVAL, however often readiness is probed.
+'''
+
+_lock = threading.Lock()
+_state = {'pid': None, 'seconds': None}
+
+
+def fill_pool(engine):
+    '''
+    open the pool's `pool_size` connections and return them to it
+    '''
+    size = engine.pool.size() if isinstance(engine.pool, QueuePool) else 1
+    connections = []
+    try:
+        for _ in range(size):
+            connection = engine.connect()
+            connections.append(connection)
+            connection.execute(select([1])).scalar()
+    finally:
+        for connection in connections:
+            connection.close()
+    return size
+
+
+def warm_up(app):
+    '''
+    warm the current process up for `app`; returns whether it is warm
+    '''
+    if ready():
+        return True
+    with _lock:
+        if ready():
+            return True
+        start = perf_counter()
+        try:
+            keys = auth.jwks_store
+            replicas = app.extensions['replicas']
+            with app.app_context():
+                metrics.recorder.start()
+                replicas.start()
+                stats_refresher.start(db.engine)
+            # the first start() fetches the keys; retries are rate limited
+            keys.start()
+            if not keys.keys:
+                keys.refresh_if_allowed()
+            if not keys.keys:
+                raise RuntimeError(f'No signing keys from {keys.url}')
+            with app.app_context():
+                fill_pool(db.engine)
+                for engine in replicas.engines:
+                    fill_pool(engine)
+                configure_mappers()
+        except Exception:
+            logger.exception('Warm-up of worker %d failed', os.getpid())
+            return False
+        _state['seconds'] = perf_counter() - start
+        _state['pid'] = os.getpid()
+        logger.info('Worker %d warmed up in %.0f ms', os.getpid(),
+                    _state['seconds'] * 1000)
+        return True
+
+
+def ready():
+    return _state['pid'] == os.getpid()
+
+
+def stats():
+    return dict(_state, ready=ready())
+
+
+def dispose_engines(app):
+    '''
+    close the pooled connections of `app`, so processes forked afterwards
+    do not share their sockets
+    '''
+    with app.app_context():
+        db.engine.dispose()
+    for engine in app.extensions['replicas'].engines:
+        engine.dispose()
+
+
+def init_app(app):
+    app.before_first_request(lambda: warm_up(app))